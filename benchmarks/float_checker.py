@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# Measures FloatChecker on large outputs of N numbers: identical to the
+# reference, differing in the last digit of 10% of the numbers, and with
+# every number printed to a different precision.  Run from anywhere, e.g.
+#
+#     benchmarks/float_checker.py --numbers 10000000
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src import checkers
+
+def outputs(n):
+    '''Returns the reference output and {case: output} for `n' numbers.'''
+    ref = [b'%.9f' % (i / 7) for i in range(n)]
+    last_digit = list(ref)
+    for i in range(0, n, 10):
+        last_digit[i] = ref[i][:-1] + (b'1' if ref[i][-1:] != b'1' else b'2')
+    reformatted = [b'%.7f' % (i / 7) for i in range(n)]
+    return b'\n'.join(ref), {
+        'identical': b'\n'.join(ref),
+        'last digit of 10%': b'\n'.join(last_digit),
+        'reformatted': b'\n'.join(reformatted),
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='FloatChecker time on large outputs.')
+    parser.add_argument('--numbers', type=int, default=10**7,
+                        help='numbers in each output (default: %(default)s)')
+    args = parser.parse_args()
+    checker = checkers.FloatChecker(1e-6, 1e-6)
+    ref, cases = outputs(args.numbers)
+    print('numpy %s' % ('available' if checkers.numpy is not None else 'not available'))
+    with tempfile.TemporaryFile() as refout:
+        refout.write(ref)
+        for name, out in cases.items():
+            with tempfile.TemporaryFile() as outfile:
+                outfile.write(out)
+                start = time.perf_counter()
+                result = checker.check(None, outfile, refout)
+                print('%-18s | %6.2f s | %s' % (name, time.perf_counter() - start,
+                                                'correct' if result.verdict == checkers.CORRECT
+                                                else result.message))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+# Measures how much CPU time the grader itself spends watching children: N
+# busy loops run in parallel under lPopen.lwait(), and the grader's own CPU
+# time (RUSAGE_SELF) is reported.  Run from anywhere, e.g.
+#
+#     benchmarks/supervisor_overhead.py 8 32 --seconds 3
+
+import argparse
+import os
+import resource
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src import platform_dependent
+
+BUSY_LOOP = ('import time\n'
+             'end = time.process_time() + %f\n'
+             'while time.process_time() < end: pass\n')
+
+def run(n, seconds):
+    '''Runs `n' busy loops of `seconds' CPU seconds in parallel, returns the grader's CPU time
+    and the wall time taken.'''
+    argv = [sys.executable, '-c', BUSY_LOOP % seconds]
+    def child():
+        lpopen = platform_dependent.lPopen(argv)
+        lpopen.lwait(tlimit=seconds * 2, mlimit=2**30, wlimit=seconds * n * 4)
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.monotonic()
+    threads = [threading.Thread(target=child) for _ in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (after.ru_utime + after.ru_stime) - (before.ru_utime + before.ru_stime)
+    return cpu, time.monotonic() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Grader CPU time for N parallel busy loops.')
+    parser.add_argument('counts', metavar='N', type=int, nargs='*', default=[8, 32])
+    parser.add_argument('--seconds', type=float, default=3,
+                        help='CPU seconds used by each busy loop (default: %(default)s)')
+    args = parser.parse_args()
+    print('    N | grader CPU | wall')
+    for n in args.counts:
+        cpu, wall = run(n, args.seconds)
+        print('%5d | %8.2f s | %6.2f s' % (n, cpu, wall))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import asyncio
+import concurrent.futures
+import threading
+
+from . import platform_dependent
+
+class AsyncEngine:
+    '''Runs test cases on an asyncio event loop rather than one thread per running test case.
+
+    Waiting for executables is left to the event loop (and the Linux backend's supervisor thread),
+    so many I/O-light test cases can be in flight at once.  Only output checking uses a small
+    thread pool.  Verdicts are exactly those of Runner.run().
+
+    From async code, use run() or results().  From threads, submit() returns a
+    concurrent.futures.Future like an executor does, with the loop running in a background
+    thread.'''
+
+    def __init__(self, max_running, checker_threads=None):
+        self.max_running = max_running
+        self._slots = None
+        self._checkers = concurrent.futures.ThreadPoolExecutor(
+            checker_threads or platform_dependent.cpu_count())
+        self._loop = None
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    async def run(self, runner, time_limit, memory_limit, wall_time_limit=None):
+        '''Runs a single test case, at most `max_running' at a time.  Returns the runner.'''
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_running)
+        await self._slots.acquire()
+        # The slot is free for the next test case while the output is checked
+        holding = [True]
+        def release():
+            if holding:
+                holding.pop()
+                self._slots.release()
+        try:
+            await runner.run_async(time_limit, memory_limit, wall_time_limit, self._checkers,
+                                   exited=release)
+        finally:
+            release()
+        return runner
+
+    async def results(self, runners, time_limit, memory_limit, wall_time_limit=None):
+        '''Runs all `runners', yielding each one as soon as it is done.'''
+        tasks = [asyncio.ensure_future(self.run(runner, time_limit, memory_limit, wall_time_limit))
+                 for runner in runners]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def submit(self, runner, time_limit, memory_limit, wall_time_limit=None):
+        '''Thread-safe: schedules a test case on the background loop and returns a
+        concurrent.futures.Future.'''
+        with self._thread_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                name='AsyncEngine loop', daemon=True)
+                self._thread.start()
+        return asyncio.run_coroutine_threadsafe(
+            self.run(runner, time_limit, memory_limit, wall_time_limit), self._loop)
+
+    def shutdown(self, wait=True):
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._stop(), self._loop)
+            if wait:
+                self._thread.join()
+        self._checkers.shutdown(wait)
+
+    async def _stop(self):
+        # Cancelled test cases still need to stop their processes and clean up
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop.stop()
@@ -0,0 +1,52 @@
+import json
+import os
+
+from .runner import Runner
+
+class Baseline:
+    '''Per-test CPU time and peak memory recorded by an earlier run, for catching performance
+    regressions.  Test cases are identified by task and input file name, so a baseline can be
+    checked in next to the test data.
+
+    A measurement regresses if it exceeds the baseline by more than `threshold' (relative) and by
+    more than `min_delta' seconds, or MEMORY_MIN_DELTA bytes for memory.'''
+
+    MEMORY_MIN_DELTA = 2**20
+
+    def __init__(self, tests=None, threshold=0.1, min_delta=0.05):
+        self.tests = tests or {}
+        self.threshold = threshold
+        self.min_delta = min_delta
+
+    @classmethod
+    def load(cls, path, **keywords):
+        with open(path, 'r') as f:
+            return cls(json.load(f), **keywords)
+
+    @staticmethod
+    def save(path, runners):
+        '''Writes the measurements of the finished ones of `runners' as a baseline.  Verdicts
+        taken from the cache are left out, their times were not measured in this run.'''
+        tests = {}
+        for runner in runners:
+            if (runner.status == Runner.DONE and runner.result != Runner.Result.CANCELLED and
+                    not runner.cached):
+                tests.setdefault(runner.task_name, {})[os.path.basename(runner.inpath)] = {
+                    'time': runner.get_time(),
+                    'memory': runner.get_memory(),
+                    }
+        with open(path, 'w') as f:
+            json.dump(tests, f, indent=1, sort_keys=True)
+
+    def regressions(self, task_name, inpath, time, memory):
+        '''Returns [(what, measured, baseline), ...] for the measurements of the test case that
+        regressed, with `what' either 'time' or 'memory'.'''
+        base = self.tests.get(task_name, {}).get(os.path.basename(inpath))
+        if base is None:
+            return []
+        result = []
+        if time - base['time'] > max(self.threshold * base['time'], self.min_delta):
+            result.append(('time', time, base['time']))
+        if memory - base['memory'] > max(self.threshold * base['memory'], self.MEMORY_MIN_DELTA):
+            result.append(('memory', memory, base['memory']))
+        return result
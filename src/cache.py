@@ -0,0 +1,140 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+
+from .clint.packages import appdirs
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS verdicts (
+    key TEXT PRIMARY KEY,
+    result INTEGER NOT NULL,
+    time REAL NOT NULL,
+    memory INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS verdicts_by_use ON verdicts (last_used);
+'''
+
+_default = None
+_default_lock = threading.Lock()
+
+def cache_dir():
+    '''Returns the per-user cache directory of mini-grader.'''
+    return appdirs.user_cache_dir('mini-grader', 'mini-grader')
+
+def get():
+    '''Returns the cache in the user cache directory, opening it if needed.'''
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = Cache(os.path.join(cache_dir(), 'cache.sqlite3'))
+        return _default
+
+def file_hash(path):
+    '''Returns the SHA-256 of the contents of the file, in hex, through the default cache.'''
+    return get().file_hash(path)
+
+def _hash_contents(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            # Hashed straight from the page cache, without copying
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as contents:
+                digest.update(contents)
+    return digest.hexdigest()
+
+
+class Cache:
+    '''Content hashes of files and verdicts of earlier runs, in an SQLite database.
+
+    File hashes are memoized by (path, mtime, size), so unchanged files are not read again.
+    Verdicts are stored under a key made of everything they depend on, and the least recently
+    used ones are evicted beyond `max_verdicts'.  Thread-safe.  Without a usable database, hashes
+    are only memoized in memory and nothing is cached.'''
+
+    def __init__(self, path, max_verdicts=100000):
+        self.path = path
+        self.max_verdicts = max_verdicts
+        self._lock = threading.Lock()
+        self._hashes = {}
+        self._db = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+            self._verdicts = self._db.execute('SELECT COUNT(*) FROM verdicts').fetchone()[0]
+        except (OSError, sqlite3.Error) as e:
+            logging.info('Cache %s not available: %s', path, e)
+            self._db = None
+
+    def _execute(self, *args):
+        # Callers hold self._lock
+        try:
+            with self._db:
+                return self._db.execute(*args).fetchall()
+        except sqlite3.Error as e:
+            logging.info('Cache %s failed: %s', self.path, e)
+            return []
+
+    def file_hash(self, path):
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        memo_key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if memo_key in self._hashes:
+                return self._hashes[memo_key]
+            if self._db is not None:
+                rows = self._execute('SELECT hash FROM file_hashes WHERE path = ? AND ' +
+                                     'mtime_ns = ? AND size = ?', memo_key)
+                if rows:
+                    self._hashes[memo_key] = rows[0][0]
+                    return rows[0][0]
+        # Hashed outside the lock, so that different files are hashed in
+        # parallel
+        digest = _hash_contents(path)
+        with self._lock:
+            self._hashes[memo_key] = digest
+            if self._db is not None:
+                self._execute('INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)',
+                              memo_key + (digest,))
+        return digest
+
+    def verdict_key(self, *parts):
+        '''Returns a key for a verdict depending on `parts', which must be JSON-serializable.'''
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    def get_verdict(self, key):
+        '''Returns (result, time, memory) stored under `key', or None.'''
+        if self._db is None:
+            return None
+        with self._lock:
+            rows = self._execute('SELECT result, time, memory FROM verdicts WHERE key = ?', (key,))
+            if not rows:
+                return None
+            self._execute('UPDATE verdicts SET last_used = ? WHERE key = ?', (time.time(), key))
+            return rows[0]
+
+    def put_verdict(self, key, result, cpu_time, memory):
+        if self._db is None:
+            return
+        with self._lock:
+            self._execute('INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?)',
+                          (key, result, cpu_time, int(memory), time.time()))
+            self._verdicts += 1
+            # Evicting in batches keeps inserts cheap
+            if self._verdicts > self.max_verdicts * 1.1:
+                self._execute('DELETE FROM verdicts WHERE key IN (SELECT key FROM verdicts ' +
+                              'ORDER BY last_used DESC LIMIT -1 OFFSET ?)', (self.max_verdicts,))
+                self._verdicts = self._execute('SELECT COUNT(*) FROM verdicts')[0][0]
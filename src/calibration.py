@@ -0,0 +1,133 @@
+'''Machine speed calibration, for giving time limits in seconds of the judge's machine.
+
+The speed factor of a machine is how much faster it runs a fixed set of reference kernels than
+the reference machine (so bigger is faster).  A time limit of T judge seconds becomes
+T * judge speed / local speed on this machine.
+
+The kernels spend their time in native code (zlib, sorting, memory copies) rather than in the
+interpreter, but they are still not the solution: the factor says nothing about differences in
+compilers, flags or instruction sets between the two machines, so scaled limits are estimates.'''
+
+import json
+import logging
+import math
+import os
+import platform
+import random
+import statistics
+import time
+import zlib
+
+from .clint.packages import appdirs
+
+# CPU seconds taken by each kernel on the reference machine, whose speed
+# factor is 1 by definition
+REFERENCE_TIMES = {
+    'integer': 0.17,
+    'float': 0.17,
+    'memory': 0.40,
+    }
+
+# Stored with each calibration.  Bumped whenever the kernels change, so that
+# speed factors measured with different kernels are never mixed.
+VERSION = 2
+
+# Each kernel is timed this many times and the median kept
+RUNS = 5
+
+def config_path():
+    return os.path.join(appdirs.user_data_dir('mini-grader', 'mini-grader'), 'calibration.json')
+
+def _integer_input():
+    # Text of random numbers, like typical test data
+    rng = random.Random(1)
+    return b' '.join(b'%d' % rng.getrandbits(31) for _ in range(150000))
+
+def _integer_kernel(text):
+    # DEFLATE, branchy integer code
+    return len(zlib.compress(text, 6))
+
+def _float_input():
+    rng = random.Random(2)
+    return [rng.random() for _ in range(500000)]
+
+def _float_kernel(values):
+    # Floating-point comparisons and exact summation
+    return math.fsum(sorted(values))
+
+def _memory_input():
+    return bytearray(64 * 2**20)
+
+def _memory_kernel(block):
+    # Copies well beyond the size of the caches, limited by memory bandwidth
+    for _ in range(8):
+        copy = bytes(block)
+        block[::4096] = copy[1::4096]
+    return len(block)
+
+# {name: (input, kernel)}, only the kernel is timed
+KERNELS = {
+    'integer': (_integer_input, _integer_kernel),
+    'float': (_float_input, _float_kernel),
+    'memory': (_memory_input, _memory_kernel),
+    }
+
+def measure():
+    '''Times the reference kernels, returns {kernel: median CPU seconds}.'''
+    result = {}
+    for name, (make_input, kernel) in KERNELS.items():
+        data = make_input()
+        times = []
+        for _ in range(RUNS):
+            start = time.process_time()
+            kernel(data)
+            times.append(time.process_time() - start)
+        result[name] = statistics.median(times)
+    return result
+
+def speed_factor(times):
+    '''Returns the geometric mean over all kernels of how much faster they ran than on the
+    reference machine.'''
+    return math.exp(statistics.mean([math.log(REFERENCE_TIMES[name] / max(times[name], 1e-6))
+                                      for name in KERNELS]))
+
+def load(machine=None):
+    '''Returns the stored speed factor of the machine, or None if it was never calibrated.'''
+    try:
+        with open(config_path(), 'r') as f:
+            entry = json.load(f).get(machine or platform.node())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning('Ignoring unreadable calibration %s: %s', config_path(), e)
+        return None
+    if not entry or entry.get('version') != VERSION:
+        return None
+    return entry['speed']
+
+def save(speed, times, machine=None):
+    path = config_path()
+    try:
+        with open(path, 'r') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        entries = {}
+    entries[machine or platform.node()] = {
+        'speed': speed,
+        'times': times,
+        'version': VERSION,
+        'calibrated': time.time(),
+        }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(entries, f, indent=1, sort_keys=True)
+
+def calibrate():
+    '''Measures the speed of this machine, stores it and prints a summary.'''
+    print('Calibrating, this takes a few seconds...')
+    times = measure()
+    speed = speed_factor(times)
+    for name in KERNELS:
+        print('%-8s | %5.3f s | reference %5.3f s' % (name, times[name], REFERENCE_TIMES[name]))
+    save(speed, times)
+    print('Speed factor of %s: %.3f (stored in %s)' % (platform.node(), speed, config_path()))
@@ -1,30 +1,613 @@
+import collections
+import copy
+import heapq
+import itertools
+import math
+import operator
 import subprocess
+import tempfile
+import threading
+
+from . import cache
+from . import platform_dependent
+
+try:
+    # Compares numbers in bulk, if available
+    import numpy
+except ImportError:
+    numpy = None
 
 WRONG_ANSWER = 0
 CORRECT = 1
 PRESENTATION_ERROR = 2
+CHECKER_ERROR = 3
+
+# The verdict of a checker, with a message describing the difference (or None), and the CPU time
+# and memory taken by the checker's own process (None when checking in the grader)
+CheckResult = collections.namedtuple('CheckResult', ['verdict', 'message', 'time', 'memory'],
+                                     defaults=[None, None, None])
+
+# Outputs are compared this many bytes at a time
+CHUNK_SIZE = 2**20
+
+# Lines or tokens are sorted in memory this many bytes at a time, counting
+# SORT_ITEM_OVERHEAD for each besides its contents: the header of the bytes
+# object and its slot in the list
+SORT_RUN_SIZE = 2**26
+SORT_ITEM_OVERHEAD = 50
+# Sorted items are written out this many at a time.  bytes.join() takes 80
+# bytes of bookkeeping per item, more than the items themselves.
+SORT_WRITE_BATCH = 2**16
+
+# Wall-clock seconds after which a special judge is considered stuck
+CHECKER_TIME_LIMIT = 60
+
+# Exit codes of testlib checkers.  Others, such as partial scores, are wrong answers.
+TESTLIB_VERDICTS = {
+    0: CORRECT,
+    1: WRONG_ANSWER,
+    2: PRESENTATION_ERROR,
+    3: CHECKER_ERROR,
+    }
+
+WHITESPACE = b' \t\n\r\x0b\x0c'
+SPACES = b' \t\x0b\x0c'
+_SPACES_TO_SPACE = bytes.maketrans(b'\t\x0b\x0c', b'   ')
+
+def _first_difference(a, b):
+    # Returns the index of the first byte at which the two differ, or None.
+    # Binary search, so that slices are compared in C.
+    length = min(len(a), len(b))
+    if a[:length] == b[:length]:
+        return length if len(a) != len(b) else None
+    low, high = 0, length
+    while high - low > 1:
+        middle = (low + high) // 2
+        if a[low:middle] == b[low:middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+def _common_prefix_length(a, b):
+    # Returns the offset of the first byte at which the two files differ, or
+    # None if they are equal
+    a.seek(0)
+    b.seek(0)
+    offset = 0
+    while True:
+        chunk_a = a.read(CHUNK_SIZE)
+        chunk_b = b.read(CHUNK_SIZE)
+        difference = _first_difference(chunk_a, chunk_b)
+        if difference is not None:
+            return offset + difference
+        if not chunk_a:
+            return None
+        offset += len(chunk_a)
+
+def _token_start(f, offset):
+    # Returns the offset of the start of the token at or before `offset'
+    end = offset
+    while end > 0:
+        start = max(0, end - CHUNK_SIZE)
+        f.seek(start)
+        window = f.read(end - start)
+        last_space = max(window.rfind(space) for space in WHITESPACE)
+        if last_space >= 0:
+            return start + last_space + 1
+        end = start
+    return 0
+
+def _count_tokens(f, end):
+    # Returns the number of tokens that start before `end', which must be
+    # the start of a token
+    f.seek(0)
+    return sum(len(tokens) for tokens in _tokens(f, end))
+
+def _tokens(f, size=None):
+    '''Yields lists of the whitespace-separated tokens of the file from its current position, a
+    chunk at a time, up to `size' bytes.'''
+    carry = b''
+    while True:
+        chunk = f.read(CHUNK_SIZE if size is None else min(CHUNK_SIZE, size))
+        if size is not None:
+            size -= len(chunk)
+        if not chunk:
+            if carry:
+                yield [carry]
+            return
+        tokens = (carry + chunk).split()
+        carry = b''
+        if tokens and chunk[-1:] not in WHITESPACE:
+            # May continue in the next chunk
+            carry = tokens.pop()
+        if tokens:
+            yield tokens
+
+def _aligned_tokens(a, b):
+    '''Yields pairs of lists of the same number of tokens of the two files, except for the last
+    pair, which has the rest of the longer file and nothing of the other (possibly also nothing).'''
+    tokens_a = _tokens(a)
+    tokens_b = _tokens(b)
+    pending_a = []
+    pending_b = []
+    while True:
+        if not pending_a:
+            pending_a = next(tokens_a, [])
+        if not pending_b:
+            pending_b = next(tokens_b, [])
+        if not pending_a or not pending_b:
+            yield pending_a, pending_b
+            return
+        length = min(len(pending_a), len(pending_b))
+        yield pending_a[:length], pending_b[:length]
+        pending_a = pending_a[length:]
+        pending_b = pending_b[length:]
+
+def _lines(f):
+    '''Yields lists of the lines of the file without whitespace at their ends, skipping empty
+    ones, a chunk at a time.'''
+    carry = b''
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            chunk_lines = [carry]
+        else:
+            chunk_lines = (carry + chunk).split(b'\n')
+            carry = chunk_lines.pop()
+        chunk_lines = list(filter(None, map(bytes.rstrip, chunk_lines)))
+        if chunk_lines:
+            yield chunk_lines
+        if not chunk:
+            return
+
+def _sorted_runs(chunks):
+    '''Sorts items given in chunks, returns temporary files of sorted runs of them, one per
+    line.'''
+    runs = []
+    items = []
+    size = 0
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is not None:
+            items.extend(chunk)
+            size += sum(map(len, chunk)) + SORT_ITEM_OVERHEAD * len(chunk)
+        if items and (chunk is None or size >= SORT_RUN_SIZE):
+            items.sort()
+            run = tempfile.TemporaryFile()
+            for start in range(0, len(items), SORT_WRITE_BATCH):
+                run.write(b'\n'.join(items[start:start + SORT_WRITE_BATCH]))
+                run.write(b'\n')
+            run.seek(0)
+            runs.append(run)
+            items = []
+            size = 0
+    return runs
+
+def _merged(runs):
+    return heapq.merge(*[(line[:-1] for line in run) for run in runs])
+
+def _show_token(token):
+    token = token.decode(errors='replace')
+    return token if len(token) <= 40 else token[:37] + '...'
+
+def _normalise_line_breaks(data):
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    return data
+
+class _Normaliser:
+    '''Normalises output for comparison ignoring whitespace, a chunk at a time: line breaks become
+    b'\\n' and whitespace at the end of lines and empty lines at the end are removed.  Only
+    whitespace that may turn out to be trailing is held back.'''
+
+    def __init__(self):
+        # Held back line breaks, and the whitespace after the last one
+        self._newlines = 0
+        self._spaces = b''
+        # Whether the last byte was b'\r', which may be followed by b'\n'
+        self._cr = False
+
+    def feed(self, data):
+        '''Returns the normalised output up to the last non-whitespace byte of `data'.'''
+        return self._feed(data, True)
+
+    def skip(self, data):
+        '''Like feed(), without computing the output.'''
+        self._feed(data, False)
+
+    def _feed(self, data, output):
+        if self._cr and data[:1] == b'\n':
+            data = data[1:]
+            self._cr = False
+        if not data:
+            return b''
+        body = data.rstrip(WHITESPACE)
+        tail = data[len(body):]
+        if body:
+            if output:
+                body = _normalise_line_breaks(b'\n' * self._newlines + self._spaces + body)
+                # Searching is much faster than splitting, and most lines
+                # have no trailing whitespace
+                if b' \n' in body.translate(_SPACES_TO_SPACE):
+                    body = b'\n'.join([line.rstrip(SPACES) for line in body.split(b'\n')])
+            self._newlines = 0
+            self._spaces = b''
+        tail = _normalise_line_breaks(tail)
+        newlines = tail.count(b'\n')
+        if newlines:
+            self._newlines += newlines
+            self._spaces = tail[tail.rindex(b'\n') + 1:]
+        else:
+            self._spaces += tail
+        self._cr = data[-1:] == b'\r'
+        return body
+
+
+class _StreamComparison:
+    '''Compares two streams given in chunks of any size.'''
+
+    def __init__(self):
+        self._a = b''
+        self._b = b''
+        self.equal = True
+
+    def feed(self, a, b):
+        a = self._a + a
+        b = self._b + b
+        length = min(len(a), len(b))
+        if a[:length] != b[:length]:
+            self.equal = False
+        self._a = a[length:]
+        self._b = b[length:]
+
+    def finish(self):
+        self.equal = self.equal and self._a == self._b
+
 
 class Checker:
+    '''Compares output to the reference output.  Output that differs only in whitespace at the
+    end of lines and empty lines at the end is a presentation error, or correct with
+    `ignore_space'.
+
+    Other ways of checking subclass this, overriding check() and cache_key().  check() is called
+    from many threads at once.'''
+
+    def __init__(self, ignore_space=False):
+        self.ignore_space = ignore_space
+
+    def cache_key(self):
+        '''Identifies how output is checked, for caching verdicts.'''
+        return 'ignore-space' if self.ignore_space else 'exact'
+
+    def close(self):
+        '''Releases anything kept for checking, once all test cases are checked.'''
+        pass
+
+    def check(self, infile_ignored, outfile, refout):
+        '''Returns a CheckResult.
+
+        Reads both files once, in chunks, so memory use does not depend on their size.  Until the
+        first difference, only the whitespace that may turn out to be trailing is tracked.'''
+        outfile.seek(0)
+        refout.seek(0)
+        common = _Normaliser()
+        normalisers = None
+        comparison = _StreamComparison()
+        offset = 0
+        while True:
+            out = outfile.read(CHUNK_SIZE)
+            ref = refout.read(CHUNK_SIZE)
+            if normalisers is None:
+                chunk_difference = _first_difference(out, ref)
+                if chunk_difference is None:
+                    if not out:
+                        return CheckResult(CORRECT)
+                    common.skip(out)
+                    offset += len(out)
+                    continue
+                difference = offset + chunk_difference
+                normalisers = (copy.copy(common), copy.copy(common))
+            comparison.feed(normalisers[0].feed(out), normalisers[1].feed(ref))
+            if not comparison.equal or not out and not ref:
+                break
+        comparison.finish()
+
+        if comparison.equal:
+            return CheckResult(CORRECT if self.ignore_space else PRESENTATION_ERROR)
+        return CheckResult(WRONG_ANSWER, 'differs at byte %d' % difference)
+
+
+class FloatChecker(Checker):
+    '''Compares output to the reference output token by token, ignoring whitespace.  Numbers
+    match within a tolerance, like numpy.isclose: |out - ref| <= abs_tol + rel_tol * |ref|.  Any
+    other tokens must be the same.
+
+    Tokens are only parsed from the first differing byte on, and then only those that differ as
+    bytes.  Each of those costs about a float() call, which dominates when most numbers are
+    printed differently from the reference; benchmarks/float_checker.py measures it.'''
+
+    def __init__(self, abs_tol=1e-6, rel_tol=1e-6):
+        self.abs_tol = abs_tol
+        self.rel_tol = rel_tol
+
+    def cache_key(self):
+        return 'float %r %r' % (self.abs_tol, self.rel_tol)
+
     def check(self, infile_ignored, outfile, refout):
-        exact_checked = False
+        difference = _common_prefix_length(outfile, refout)
+        if difference is None:
+            return CheckResult(CORRECT)
+        # The files are the same up to here, and so are their tokens
+        start = _token_start(refout, difference)
+        outfile.seek(start)
+        refout.seek(start)
+        index = 0
+        for out, ref in _aligned_tokens(outfile, refout):
+            if len(out) != len(ref):
+                if out:
+                    return CheckResult(WRONG_ANSWER,
+                                       self._message(refout, start, index, None, out[0]))
+                return CheckResult(WRONG_ANSWER, self._message(refout, start, index, ref[0], None))
+            if not out:
+                return CheckResult(CORRECT)
+            if out != ref:
+                mismatch = self._first_mismatch(out, ref)
+                if mismatch is not None:
+                    return CheckResult(WRONG_ANSWER,
+                                       self._message(refout, start, index + mismatch,
+                                                     ref[mismatch], out[mismatch]))
+            index += len(out)
+
+    def _message(self, refout, start, index, expected, got):
+        # Tokens before the first difference were not counted so far
+        index += _count_tokens(refout, start) + 1
+        return 'token %d: expected %s, got %s' % (
+            index,
+            _show_token(expected) if expected is not None else 'end of output',
+            _show_token(got) if got is not None else 'end of output')
+
+    def _first_mismatch(self, out, ref):
+        # Returns the index of the first token out of tolerance, or None
+        indices = list(itertools.compress(range(len(out)), map(operator.ne, out, ref)))
+        if numpy is not None and len(indices) * 2 > len(out):
+            # Most tokens differ, e.g. numbers printed with other precision.
+            # Parsing all of them in bulk is cheaper than picking them out.
+            try:
+                return self._first_mismatch_bulk(out, ref)
+            except ValueError:
+                pass
+        out_tokens = [out[i] for i in indices]
+        ref_tokens = [ref[i] for i in indices]
+        try:
+            if numpy is not None:
+                mismatch = self._first_mismatch_bulk(out_tokens, ref_tokens)
+                return indices[mismatch] if mismatch is not None else None
+            out_numbers = list(map(float, out_tokens))
+            ref_numbers = list(map(float, ref_tokens))
+        except ValueError:
+            # Not all numbers, look at each token
+            close = map(self._close, out_tokens, ref_tokens)
+        else:
+            close = map(self._close_numbers, out_numbers, ref_numbers)
+        return next((index for index, index_close in zip(indices, close) if not index_close),
+                    None)
+
+    def _first_mismatch_bulk(self, out, ref):
+        # Parses the tokens straight into arrays and compares them at once,
+        # raises ValueError if not all are numbers
+        out_numbers = numpy.fromiter(map(float, out), float, len(out))
+        ref_numbers = numpy.fromiter(map(float, ref), float, len(ref))
+        close = numpy.isclose(out_numbers, ref_numbers, rtol=self.rel_tol, atol=self.abs_tol)
+        # Identical tokens match however they parse (NaN)
+        return next((int(i) for i in numpy.flatnonzero(~close) if out[i] != ref[i]), None)
+
+    def _close(self, out, ref):
+        try:
+            return self._close_numbers(float(out), float(ref))
+        except ValueError:
+            return False
+
+    def _close_numbers(self, out, ref):
+        # Infinities are only close to themselves (an infinite tolerance would
+        # accept anything), NaN to nothing, as with numpy.isclose
+        if math.isinf(out) or math.isinf(ref):
+            return out == ref
+        return out == ref or abs(out - ref) <= self.abs_tol + self.rel_tol * abs(ref)
+
+
+class UnorderedChecker(Checker):
+    '''Accepts output whose lines or tokens, by `unit', are a permutation of those of the
+    reference output.  Lines are compared without whitespace at their ends, and empty lines are
+    ignored.
+
+    Both are first compared by the count and sum of the hashes of their lines or tokens, in one
+    pass.  Only if those differ are both sorted, in runs on disk that are then merged, to find a
+    difference.'''
+
+    UNITS = ('lines', 'tokens')
+
+    def __init__(self, unit='lines'):
+        self.unit = unit
+
+    def cache_key(self):
+        return 'unordered ' + self.unit
+
+    def _items(self, f):
+        f.seek(0)
+        return _lines(f) if self.unit == 'lines' else _tokens(f)
+
+    def _fingerprint(self, f):
+        count = 0
+        hash_sum = 0
+        for items in self._items(f):
+            count += len(items)
+            hash_sum += sum(map(hash, items))
+        return count, hash_sum
+
+    def check(self, infile_ignored, outfile, refout):
+        if self._fingerprint(outfile) == self._fingerprint(refout):
+            return CheckResult(CORRECT)
+        out_runs = _sorted_runs(self._items(outfile))
+        ref_runs = _sorted_runs(self._items(refout))
         try:
-            args = ['/usr/bin/cmp', '--silent', outfile.name, refout.name]
-            code = subprocess.call(args, stdout=subprocess.DEVNULL)
-            if code == 0:
-                return CORRECT
-            exact_checked = True
-        except FileNotFoundError:
+            return self._difference(_merged(out_runs), _merged(ref_runs))
+        finally:
+            for run in out_runs + ref_runs:
+                run.close()
+
+    def _difference(self, out, ref):
+        # Walks both sorted sequences, returns the CheckResult about the first
+        # item in one but not the other
+        item = self.unit[:-1]
+        out_item = next(out, None)
+        ref_item = next(ref, None)
+        while out_item is not None or ref_item is not None:
+            if ref_item is None or out_item is not None and out_item < ref_item:
+                return CheckResult(WRONG_ANSWER,
+                                   'unexpected %s %s' % (item, _show_token(out_item)))
+            if out_item is None or ref_item < out_item:
+                return CheckResult(WRONG_ANSWER, 'missing %s %s' % (item, _show_token(ref_item)))
+            out_item = next(out, None)
+            ref_item = next(ref, None)
+        # Only the hashes differed
+        return CheckResult(CORRECT)
+
+
+def _first_line(text):
+    # A checker's comment, shortened to fit on a row of the scoreboard
+    line = text.strip().split('\n', 1)[0].strip()
+    return (line if len(line) <= 80 else line[:77] + '...') or None
+
+class _BatchWorker:
+    '''A special judge process that checks test cases one after another.'''
+
+    def __init__(self, path):
+        self.process = platform_dependent.lPopen([path, '--batch'],
+                                                 stdin=subprocess.PIPE,
+                                                 stdout=subprocess.PIPE,
+                                                 stderr=subprocess.DEVNULL)
+
+    def check(self, infile, outfile, refout):
+        start_time, _ = self.process.usage()
+        request = '\t'.join([infile.name, outfile.name, refout.name]) + '\n'
+        # A stuck checker is killed, which ends the reply
+        timer = threading.Timer(CHECKER_TIME_LIMIT, self.process.kill)
+        timer.start()
+        try:
+            self.process.stdin.write(request.encode())
+            self.process.stdin.flush()
+            reply = self.process.stdout.readline()
+        except OSError:
+            reply = b''
+        finally:
+            timer.cancel()
+        cpu_time, memory = self.process.usage()
+        code, _, message = reply.decode(errors='replace').strip().partition(' ')
+        if not code.lstrip('-').isdigit():
+            return None
+        return CheckResult(TESTLIB_VERDICTS.get(int(code), WRONG_ANSWER), _first_line(message),
+                           cpu_time - start_time, memory)
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
             pass
-        out = outfile.read()
-        ref = refout.read()
-        if not exact_checked and out == ref:
-            return CORRECT
-        ref_lines = self.trim_whitespace(ref.splitlines())
-        out_lines = self.trim_whitespace(out.splitlines())
-        return PRESENTATION_ERROR if ref_lines == out_lines else WRONG_ANSWER
-
-    def trim_whitespace(self, lines):
-        lines = [line.rstrip() for line in lines]
-        while lines and not lines[-1].strip():
-            lines.pop()
-        return lines
+        self.process.abort()
+        self.process.lwait(None, None)
+        self.process.stdout.close()
+
+
+class CheckerPool:
+    '''Processes of a special judge that stay alive across test cases, started as needed so that
+    each check has one to itself.'''
+
+    def __init__(self, path):
+        self.path = path
+        self._idle = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return _BatchWorker(self.path)
+
+    def release(self, worker):
+        with self._lock:
+            if not self._closed:
+                self._idle.append(worker)
+                return
+        worker.stop()
+
+    def discard(self, worker):
+        worker.stop()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+        for worker in idle:
+            worker.stop()
+
+
+class SpecialJudge(Checker):
+    '''Checks output with a testlib-style checker executable, run as `checker input output answer'
+    with the verdict as its exit code (see TESTLIB_VERDICTS) and a comment on standard error.
+
+    With `batch', the checker instead runs as `checker --batch' and stays alive across test
+    cases: for each one, it reads a line with the three paths separated by tabs from standard
+    input, and writes a line with the exit code it would have returned, optionally followed by a
+    space and a comment.
+
+    The checker's own CPU time and peak memory are reported along with its verdict.'''
+
+    def __init__(self, path, batch=False):
+        self.path = path
+        self.pool = CheckerPool(path) if batch else None
+
+    def cache_key(self):
+        return 'special %s %s' % (cache.file_hash(self.path), self.pool is not None)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+
+    def check(self, infile, outfile, refout):
+        if self.pool is None:
+            return self._check_once(infile, outfile, refout)
+        try:
+            worker = self.pool.acquire()
+        except OSError as e:
+            return CheckResult(CHECKER_ERROR, 'cannot run checker: %s' % e.strerror)
+        result = worker.check(infile, outfile, refout)
+        if result is None:
+            self.pool.discard(worker)
+            return CheckResult(CHECKER_ERROR, 'checker did not answer')
+        self.pool.release(worker)
+        return result
+
+    def _check_once(self, infile, outfile, refout):
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                process = platform_dependent.lPopen([self.path, infile.name, outfile.name,
+                                                     refout.name],
+                                                    stdin=subprocess.DEVNULL,
+                                                    stdout=subprocess.DEVNULL,
+                                                    stderr=stderr)
+            except OSError as e:
+                return CheckResult(CHECKER_ERROR, 'cannot run checker: %s' % e.strerror)
+            process.lwait(None, None, CHECKER_TIME_LIMIT)
+            stderr.seek(0)
+            message = _first_line(stderr.read(4096).decode(errors='replace'))
+        if process.idleout:
+            verdict = CHECKER_ERROR
+            message = 'checker took over %d s' % CHECKER_TIME_LIMIT
+        elif process.exitcode < 0:
+            verdict = CHECKER_ERROR
+            message = 'checker crashed'
+        else:
+            verdict = TESTLIB_VERDICTS.get(process.exitcode, WRONG_ANSWER)
+        return CheckResult(verdict, message, process.time, process.vmpeak)
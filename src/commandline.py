@@ -2,10 +2,20 @@
 
 import argparse
 import multiprocessing
+import os
 import re
 import sys
 
+from . import calibration
 from . import platform_dependent
+from .checkers import UnorderedChecker
+from .repeat import RepeatedRunner
+
+# Default wall-clock limit, as a multiple of the CPU time limit
+WALL_TIME_LIMIT_FACTOR = 3
+
+# Default number of runs of each executable with --compare
+COMPARE_ROUNDS = 5
 
 DESCRIPTION = (
     'Mini grader for programming competition tasks, especially for contests with downloadable ' +
@@ -13,6 +23,11 @@ DESCRIPTION = (
     )
 
 def parse():
+    if sys.argv[1:2] == ['history']:
+        return parse_history(sys.argv[2:])
+    if sys.argv[1:2] == ['calibrate']:
+        return parse_calibrate(sys.argv[2:])
+
     parser = argparse.ArgumentParser(description=DESCRIPTION)
     parser.add_argument('executable',
                         help='path to executable')
@@ -30,11 +45,87 @@ def parse():
                         metavar='SECONDS',
                         type=float,
                         help='time limit in seconds (default is unlimited)')
+    parser.add_argument('--judge-time',
+                        action='store_true',
+                        help="time limit is in seconds of the judge's machine, scaled by the " +
+                             "speed of this machine as measured with 'calibrate'")
+    parser.add_argument('--judge-speed',
+                        default=1.0,
+                        metavar='FACTOR',
+                        type=float,
+                        help="with --judge-time, speed factor of the judge's machine, as " +
+                             "reported by 'calibrate' on it (default is 1.0)")
+    parser.add_argument('--wall-time-limit',
+                        metavar='SECONDS',
+                        type=float,
+                        help='wall-clock time limit in seconds, catches solutions that sleep or ' +
+                             'wait for input (default is %d times the time limit)' %
+                             WALL_TIME_LIMIT_FACTOR)
+    parser.add_argument('--kernel-limits',
+                        action='store_true',
+                        help='also have the kernel enforce the limits (setrlimit), so that runaway ' +
+                             'solutions are stopped before the next sample; breaks ASAN binaries. ' +
+                             'The memory backstop is the limit plus physical memory, so that ' +
+                             'verdicts do not change')
+    parser.add_argument('--cgroup',
+                        action='store_true',
+                        help='account and limit each test case through a cgroup v2 of its own ' +
+                             'when one is delegated (Linux only); memory is then resident ' +
+                             'memory including page cache instead of virtual memory (VmPeak)')
+
+    parser.add_argument('--compare',
+                        metavar='EXECUTABLE',
+                        help='compare the CPU times of this executable (B) to those of the main ' +
+                             'one (A) on each test case, running both alternately')
+    parser.add_argument('-r', '--repeat',
+                        metavar='N',
+                        type=int,
+                        help='run each test case N times, showing the median time and its ' +
+                             'standard deviation (default is %d with --compare)' % COMPARE_ROUNDS)
+    parser.add_argument('--repeat-policy',
+                        default='median',
+                        choices=RepeatedRunner.POLICIES,
+                        help='with --repeat, give a time limit verdict if the limit was exceeded ' +
+                             'in more than half of the runs, in any run or in all runs ' +
+                             '(default is median)')
+    parser.add_argument('--fresh',
+                        action='store_true',
+                        help='run every test case, even if the executable and test data did not ' +
+                             'change since a cached run (implied by --baseline and ' +
+                             '--record-baseline)')
+    parser.add_argument('--baseline',
+                        metavar='FILE',
+                        help='fail test cases whose CPU time or memory regressed compared to a ' +
+                             'baseline recorded with --record-baseline')
+    parser.add_argument('--record-baseline',
+                        metavar='FILE',
+                        help='record CPU times and memory of this run as a baseline')
+    parser.add_argument('--regression-threshold',
+                        default=10,
+                        metavar='PERCENT',
+                        type=float,
+                        help='how much slower or bigger than the baseline counts as a regression ' +
+                             '(default is 10%%)')
+    parser.add_argument('--regression-min-delta',
+                        default=0.05,
+                        metavar='SECONDS',
+                        type=float,
+                        help='ignore time regressions smaller than this (default is 0.05)')
+    parser.add_argument('--regression-reruns',
+                        default=3,
+                        metavar='N',
+                        type=int,
+                        help='measure regressed test cases up to this many more times and keep ' +
+                             'the best, to rule out noise (default is 3)')
 
     parser.add_argument('-x', '--examples-only',
                         dest='example_run',
                         action='store_true',
                         help='consider only example filename patterns for test data')
+    parser.add_argument('--fail-fast',
+                        action='store_true',
+                        help='stop at the first test case that does not pass; examples and test ' +
+                             'cases that failed in the previous run are tried first')
     parser.add_argument('--task',
                         help='task name, used to search for test data (default is to infer from ' +
                              'executable name and/or current directory)')
@@ -43,6 +134,22 @@ def parse():
                         default=platform_dependent.cpu_count(),
                         type=int,
                         help='run this many test cases in parallel (default is CPU count)')
+    parser.add_argument('--engine',
+                        default='threads',
+                        choices=['threads', 'asyncio'],
+                        help='run test cases from a thread pool, or from an asyncio event loop ' +
+                             'which scales to many concurrent I/O-light test cases (default is ' +
+                             'threads)')
+    parser.add_argument('--memory-headroom',
+                        action=StoreMemoryLimitAction,
+                        default=2**29,
+                        metavar='MEM',
+                        help='start test cases only while their memory limits fit in available ' +
+                             "memory minus this much, e.g. '1G' (default is 512M)")
+    parser.add_argument('--pin-cpus',
+                        action='store_true',
+                        help='pin each running test case to a physical core of its own, leaving ' +
+                             'its hyperthreads idle, for more stable timings (Linux only)')
     parser.add_argument('--usaco',
                         dest='usaco_style_io',
                         action='store_true',
@@ -53,11 +160,89 @@ def parse():
     parser.add_argument('-w', '--ignore-space',
                         action='store_true',
                         help='ignore trailing spaces and empty lines when checking output')
+    parser.add_argument('--float-tolerance',
+                        metavar='EPS',
+                        type=float,
+                        help='compare output token by token, ignoring whitespace, with numbers ' +
+                             'matching within an absolute or relative error of EPS, e.g. 1e-6')
+    parser.add_argument('--unordered',
+                        choices=UnorderedChecker.UNITS,
+                        help='accept output whose lines or tokens are in any order, ignoring ' +
+                             'whitespace at the ends of lines and empty lines')
+    parser.add_argument('--checker',
+                        metavar='EXECUTABLE',
+                        help='check output with this testlib-style checker, run as ' +
+                             "'EXECUTABLE input output answer'")
+    parser.add_argument('--checker-batch',
+                        action='store_true',
+                        help="the checker speaks the batch protocol when run as 'EXECUTABLE " +
+                             "--batch' (see checkers.SpecialJudge), and is kept running across " +
+                             'test cases')
     parser.add_argument('--color',
                         default='auto',
                         choices=['auto', 'always', 'none'],
                         help='colored output')
     args = parser.parse_args()
+    args.command = 'grade'
+    if [args.float_tolerance, args.unordered, args.checker].count(None) < 2:
+        parser.error('only one of --float-tolerance, --unordered and --checker can be given')
+    if args.checker_batch and args.checker is None:
+        parser.error('--checker-batch needs --checker')
+    if args.baseline is not None or args.record_baseline is not None:
+        # Baselines are about measurements, cached times may be stale
+        args.fresh = True
+    args.judge_time_limit = None
+    if args.judge_time and args.time_limit < sys.maxsize:
+        local_speed = calibration.load()
+        if local_speed is None:
+            parser.error("--judge-time needs the speed of this machine, run '%s calibrate' first" %
+                         os.path.basename(sys.argv[0]))
+        args.judge_time_limit = args.time_limit
+        args.time_limit = args.time_limit * args.judge_speed / local_speed
+    if args.wall_time_limit is None and args.time_limit < sys.maxsize:
+        args.wall_time_limit = WALL_TIME_LIMIT_FACTOR * args.time_limit
+    return args
+
+def parse_history(argv):
+    parser = argparse.ArgumentParser(
+        prog='%s history' % os.path.basename(sys.argv[0]),
+        description='Show recent CPU times and memory of each test case on this machine, and ' +
+                    'their change since the previous run.')
+    parser.add_argument('executable',
+                        nargs='?',
+                        help='only show runs of this executable (compared by contents)')
+    parser.add_argument('--task',
+                        help='only show this task')
+    parser.add_argument('-n', '--runs',
+                        default=5,
+                        type=int,
+                        help='show times of this many runs (default is 5)')
+    parser.add_argument('--verbose',
+                        action='store_true',
+                        help='output informational messages')
+    parser.add_argument('--color',
+                        default='auto',
+                        choices=['auto', 'always', 'none'],
+                        help='colored output')
+    args = parser.parse_args(argv)
+    args.command = 'history'
+    return args
+
+def parse_calibrate(argv):
+    parser = argparse.ArgumentParser(
+        prog='%s calibrate' % os.path.basename(sys.argv[0]),
+        description='Measure the speed of this machine on reference kernels, for time limits ' +
+                    'given with --judge-time.  The kernels run native code from the Python ' +
+                    'runtime, not your compiler\'s, so scaled limits are only estimates.')
+    parser.add_argument('--verbose',
+                        action='store_true',
+                        help='output informational messages')
+    parser.add_argument('--color',
+                        default='auto',
+                        choices=['auto', 'always', 'none'],
+                        help='colored output')
+    args = parser.parse_args(argv)
+    args.command = 'calibrate'
     return args
 
 class StoreMemoryLimitAction(argparse.Action):
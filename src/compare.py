@@ -0,0 +1,158 @@
+import concurrent.futures
+import signal
+import threading
+
+from . import stats
+from .clint.textui import colored
+from .runner import Runner
+from .scoreboard import RESULT_COLOR_TEXT
+
+# CPU times are clamped to the clock resolution, so that ratios are defined
+MIN_TIME = 0.001
+
+# Test cases faster than this are mostly startup noise and are not compared
+MIN_COMPARED_TIME = 0.01
+
+class _SameCpu:
+    '''Stands in for CpuSlots, always handing out the same CPU.'''
+
+    def __init__(self, cpu):
+        self.cpu = cpu
+
+    def acquire(self):
+        return self.cpu
+
+    def release(self, cpu):
+        pass
+
+
+class Comparison:
+    '''Compares the CPU times of two executables, A and B, on each test case.
+
+    The executables are run alternately, `rounds' times each, in ABBA order so that drift (e.g.
+    thermal throttling) affects both alike.  With `cpu_slots', both run on the same core.
+    Different test cases are compared in parallel.  Reports the per-test ratio of B's time to
+    A's with a 95% confidence interval, and the geometric mean over all test cases.'''
+
+    def __init__(self, infiles, runners, executable_b, rounds, cpu_slots=None):
+        self.infiles = infiles
+        self.runners = runners
+        self.executable_b = executable_b
+        self.rounds = rounds
+        self.cpu_slots = cpu_slots
+        self._aborted = False
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def start(self, time_limit, memory_limit, wall_time_limit, nthreads):
+        '''Runs the comparison and prints the results, returns the number of test cases on
+        which either executable failed.'''
+        limits = (time_limit, memory_limit, wall_time_limit)
+        first_column_width = max(len(infile) for infile in self.infiles)
+        print('A: %s' % self.runners[0].executable)
+        print('B: %s' % self.executable_b)
+        print('%-*s | %-13s | %-13s | %5s | %5s | %s' %
+              (first_column_width, '', 'A', 'B', 'A', 'B', 'B/A time'))
+        failures = 0
+        ratios = []
+        with concurrent.futures.ThreadPoolExecutor(nthreads) as executor:
+            futures = [executor.submit(self._compare_one, runner, limits)
+                       for runner in self.runners]
+            try:
+                for infile, future in zip(self.infiles, futures):
+                    samples = future.result()
+                    if samples is None:
+                        continue
+                    failed = self._write_row(first_column_width, infile, *samples)
+                    failures += failed
+                    if not failed and self._comparable(*samples[:2]):
+                        ratios.append(stats.geometric_mean_interval(
+                            [b / a for a, b in zip(samples[0], samples[1])])[0])
+            except KeyboardInterrupt:
+                self.abort()
+                for future in futures:
+                    future.cancel()
+                print()
+                return 128 + signal.SIGINT
+
+        if ratios:
+            ratio, low, high = stats.geometric_mean_interval(ratios)
+            print('B takes %.3fx the time of A (geometric mean over %d test cases%s)' %
+                  (ratio, len(ratios),
+                   ', 95%% CI %.3f-%.3f' % (low, high) if low is not None else ''))
+        return failures
+
+    def abort(self):
+        with self._lock:
+            self._aborted = True
+            running = list(self._running)
+        for runner in running:
+            runner.abort()
+
+    def _compare_one(self, runner, limits):
+        # Returns ([A times], [B times], A verdicts, B verdicts), or None if
+        # aborted
+        cpu = self.cpu_slots.acquire() if self.cpu_slots is not None else None
+        try:
+            same_cpu = _SameCpu(cpu) if cpu is not None else None
+            executables = (runner.executable, self.executable_b)
+            times = ([], [])
+            verdicts = (set(), set())
+            for i in range(self.rounds):
+                for which in ((0, 1) if i % 2 == 0 else (1, 0)):
+                    measured = runner.copy(executable=executables[which], cpu_slots=same_cpu,
+                                           cache=None, admission=None)
+                    with self._lock:
+                        if self._aborted:
+                            return None
+                        self._running.add(measured)
+                    try:
+                        measured.run(*limits)
+                    finally:
+                        with self._lock:
+                            self._running.discard(measured)
+                    if measured.status != Runner.DONE or measured.result == Runner.Result.CANCELLED:
+                        return None
+                    times[which].append(max(measured.get_time(), MIN_TIME))
+                    verdicts[which].add(measured.result)
+            return times + verdicts
+        finally:
+            if cpu is not None:
+                self.cpu_slots.release(cpu)
+
+    def _comparable(self, times_a, times_b):
+        return max(min(times_a), min(times_b)) >= MIN_COMPARED_TIME
+
+    def _write_row(self, first_column_width, infile, times_a, times_b, verdicts_a, verdicts_b):
+        # Returns whether either executable failed
+        texts = []
+        for verdicts in (verdicts_a, verdicts_b):
+            # Show the worst verdict of all rounds
+            verdict = max(verdicts, key=lambda result: result != Runner.Result.PASSED)
+            color, text = RESULT_COLOR_TEXT[verdict]
+            text = '%-13s' % text
+            texts.append(color(text) if color is not None else text)
+        failed = verdicts_a != {Runner.Result.PASSED} or verdicts_b != {Runner.Result.PASSED}
+        if failed:
+            comparison = ''
+        elif not self._comparable(times_a, times_b):
+            comparison = 'too fast to compare'
+        else:
+            ratio, low, high = stats.geometric_mean_interval(
+                [b / a for a, b in zip(times_a, times_b)])
+            comparison = '%.3f' % ratio
+            if low is not None:
+                comparison += ' [%.3f, %.3f]' % (low, high)
+            if low is not None and high < 1:
+                comparison = colored.green(comparison)
+            elif low is not None and low > 1:
+                comparison = colored.red(comparison)
+        print('%-*s | %s | %s | %5.2f | %5.2f | %s' %
+              (first_column_width,
+               infile,
+               texts[0],
+               texts[1],
+               min(times_a),
+               min(times_b),
+               comparison))
+        return failed
@@ -0,0 +1,147 @@
+import logging
+import os
+import platform
+import sqlite3
+import time
+
+from . import cache
+from .runner import Runner
+from .scoreboard import RESULT_COLOR_TEXT
+from .test_data_search import natural_key
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    machine TEXT NOT NULL,
+    executable TEXT NOT NULL,
+    executable_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    task TEXT NOT NULL,
+    test TEXT NOT NULL,
+    time REAL NOT NULL,
+    memory INTEGER NOT NULL,
+    verdict TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_test ON results (task, test, run_id);
+'''
+
+RESULT_NAMES = {value: name for name, value in vars(Runner.Result).items() if name.isupper()}
+
+
+class History:
+    '''CPU time, memory and verdict of every test case of every run, in an SQLite database under
+    the user cache directory.  Results are keyed by task, test case (the real path of its input
+    file), the hash of the executable, and the machine they were measured on.
+
+    Without a usable database, the history is empty and nothing is recorded.'''
+
+    def __init__(self, path=None, machine=None):
+        self.path = path or os.path.join(cache.cache_dir(), 'history.sqlite3')
+        self.machine = machine or platform.node()
+        self._db = None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=10)
+            self._db.executescript(SCHEMA)
+        except (OSError, sqlite3.Error) as e:
+            logging.info('History %s not available: %s', self.path, e)
+            self._db = None
+
+    def _latest(self, task, inpath):
+        if self._db is None:
+            return None
+        return self._db.execute(
+            'SELECT time, verdict FROM results JOIN runs ON runs.id = results.run_id '
+            'WHERE task = ? AND test = ? AND machine = ? ORDER BY run_id DESC LIMIT 1',
+            (task, os.path.realpath(inpath), self.machine)).fetchone()
+
+    def get_time(self, task, inpath):
+        '''Returns the CPU time of the last run of the test case, or None if it never ran.'''
+        latest = self._latest(task, inpath)
+        return latest[0] if latest is not None else None
+
+    def failed(self, task, inpath):
+        '''Returns whether the test case did not pass the last time it ran.'''
+        latest = self._latest(task, inpath)
+        return latest is not None and latest[1] != 'PASSED'
+
+    def record(self, executable, runners):
+        '''Records a run of `executable' on the finished ones of `runners'.'''
+        finished = [runner for runner in runners if runner.status == Runner.DONE and
+                    runner.result != Runner.Result.CANCELLED and not runner.cached]
+        if self._db is None or not finished:
+            return
+        try:
+            with self._db:
+                run_id = self._db.execute(
+                    'INSERT INTO runs (started, machine, executable, executable_hash) '
+                    'VALUES (?, ?, ?, ?)',
+                    (time.time(), self.machine, os.path.realpath(executable),
+                     cache.file_hash(executable))).lastrowid
+                self._db.executemany(
+                    'INSERT INTO results (run_id, task, test, time, memory, verdict) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [(run_id, runner.task_name, os.path.realpath(runner.inpath),
+                      runner.get_time(), int(runner.get_memory()), RESULT_NAMES[runner.result])
+                     for runner in finished])
+        except (OSError, sqlite3.Error) as e:
+            logging.info('Could not record history in %s: %s', self.path, e)
+
+    def trends(self, task=None, executable=None, runs=5):
+        '''Returns {(task, test): [(time, memory, verdict), ...]} with the last `runs' results of
+        each test case on this machine, newest first.  Only runs of the same executable contents
+        are included if `executable' is given.'''
+        if self._db is None:
+            return {}
+        query = ('SELECT task, test, time, memory, verdict FROM results '
+                 'JOIN runs ON runs.id = results.run_id WHERE machine = ?')
+        params = [self.machine]
+        if task is not None:
+            query += ' AND task = ?'
+            params.append(task)
+        if executable is not None:
+            query += ' AND executable_hash = ?'
+            params.append(cache.file_hash(executable))
+        result = {}
+        for task, test, cpu_time, memory, verdict in self._db.execute(
+                query + ' ORDER BY run_id DESC', params):
+            rows = result.setdefault((task, test), [])
+            if len(rows) < runs:
+                rows.append((cpu_time, memory, verdict))
+        return result
+
+
+def show_trends(history, task=None, executable=None, runs=5):
+    '''Prints the latest time and memory of each test case, the change since the run before it,
+    and the times of earlier runs.'''
+    trends = history.trends(task, executable, runs)
+    if not trends:
+        print('No history found.')
+        return
+    keys = sorted(trends, key=lambda key: (key[0], natural_key(os.path.basename(key[1]))))
+    first_column_width = max(len(os.path.basename(test)) for _, test in keys)
+    last_task = None
+    for task, test in keys:
+        if task != last_task:
+            print('%s:' % task)
+            last_task = task
+        rows = trends[(task, test)]
+        cpu_time, memory, verdict = rows[0]
+        color, text = RESULT_COLOR_TEXT[getattr(Runner.Result, verdict)]
+        text = '%-13s' % text
+        time_delta = memory_delta = ''
+        if len(rows) > 1:
+            time_delta = '%+6.2f' % (cpu_time - rows[1][0])
+            memory_delta = '%+5dM' % int((memory - rows[1][1]) / 2**20)
+        print('%-*s | %s | %5.2f %6s | %4dM %6s | %s' %
+              (first_column_width,
+               os.path.basename(test),
+               color(text) if color is not None else text,
+               cpu_time,
+               time_delta,
+               memory // 2**20,
+               memory_delta,
+               ' '.join('%.2f' % row[0] for row in reversed(rows))))
@@ -5,13 +5,24 @@ import logging
 import multiprocessing
 import os
 import re
+import signal
 import sys
+import threading
 import time
 
+from . import cache
+from . import calibration
 from . import checkers
 from . import commandline
+from . import history
+from . import platform_dependent
+from . import scheduler
+from .async_engine import AsyncEngine
+from .baseline import Baseline
+from .compare import Comparison
 from .clint.textui import colored
 from .scoreboard import Scoreboard
+from .repeat import RepeatedRunner
 from .runner import Runner
 from .test_data_search import TestDataSearch
 
@@ -24,6 +35,13 @@ def main():
     if args.color != 'auto':
         colored.setColorEnabled(args.color == 'always')
 
+    if args.command == 'history':
+        history.show_trends(history.History(), args.task, args.executable, args.runs)
+        return
+    if args.command == 'calibrate':
+        calibration.calibrate()
+        return
+
     # Look for test data
     test_data_search_dir = args.test_data_dir
     if test_data_search_dir is None:
@@ -33,25 +51,135 @@ def main():
                            args.task,
                            args.executable).search()
 
-    logging.info('Running %d test cases in parallel', args.nthreads)
-    executor = concurrent.futures.ThreadPoolExecutor(args.nthreads)
-    scoreboard = Scoreboard()
-    runners = []
-    futures = []
+    cpu_slots = None
+    if args.pin_cpus:
+        if platform_dependent.CpuSlots is None:
+            logging.warning('Pinning to CPUs is not supported on this platform')
+        else:
+            cpu_slots = platform_dependent.CpuSlots()
+            if args.nthreads > len(cpu_slots):
+                logging.warning('Running %d test cases on %d physical cores, timings will be ' +
+                                'less stable', args.nthreads, len(cpu_slots))
+    run_slots = None
+    admission = scheduler.MemoryAdmission.from_available_memory(args.memory_headroom)
+    if admission is not None:
+        logging.info('Admitting test cases within %dM of memory', admission.budget // 2**20)
+
+    if args.checker is not None:
+        checker = checkers.SpecialJudge(args.checker, batch=args.checker_batch)
+    elif args.float_tolerance is not None:
+        checker = checkers.FloatChecker(args.float_tolerance, args.float_tolerance)
+    elif args.unordered is not None:
+        checker = checkers.UnorderedChecker(args.unordered)
+    else:
+        checker = checkers.Checker(args.ignore_space)
 
-    for test_case in tests:
+    def make_runner(test_case):
         infilepath = os.path.join(test_case.dirpath, test_case.infile)
         outfilepath = os.path.join(test_case.dirpath, test_case.outfile)
-        runner = Runner(test_case.task,
-                        args.executable,
-                        infilepath,
-                        outfilepath,
-                        checkers.Checker(),
-                        args.usaco_style_io)
-        future = executor.submit(runner.run, args.time_limit, args.memory_limit)
-        scoreboard.add(test_case.infile, runner, future)
-        runners.append(runner)
-
-    code = scoreboard.start()
+        return Runner(test_case.task,
+                      args.executable,
+                      infilepath,
+                      outfilepath,
+                      checker,
+                      args.usaco_style_io,
+                      kernel_limits=args.kernel_limits,
+                      cpu_slots=cpu_slots,
+                      admission=admission,
+                      cache=cache.get(),
+                      fresh=args.fresh,
+                      run_slots=run_slots,
+                      cgroup=args.cgroup)
+
+    if args.compare is not None:
+        # Both executables run on the same core whenever possible
+        if cpu_slots is None and platform_dependent.CpuSlots is not None:
+            cpu_slots = platform_dependent.CpuSlots()
+        comparison = Comparison([test_case.infile for test_case in tests],
+                                [make_runner(test_case) for test_case in tests],
+                                args.compare,
+                                args.repeat or commandline.COMPARE_ROUNDS,
+                                cpu_slots)
+        code = comparison.start(args.time_limit, args.memory_limit, args.wall_time_limit,
+                                args.nthreads)
+        checker.close()
+        sys.exit(code)
+
+    logging.info('Running %d test cases in parallel', args.nthreads)
+    if args.engine == 'asyncio':
+        executor = AsyncEngine(args.nthreads)
+    else:
+        # Output is checked in extra threads, while at most `nthreads' test
+        # cases run
+        executor = concurrent.futures.ThreadPoolExecutor(args.nthreads +
+                                                         platform_dependent.cpu_count())
+        run_slots = threading.Semaphore(args.nthreads)
+    baseline = None
+    if args.baseline is not None:
+        try:
+            baseline = Baseline.load(args.baseline,
+                                     threshold=args.regression_threshold / 100,
+                                     min_delta=args.regression_min_delta)
+        except (OSError, ValueError) as e:
+            logging.error('Cannot read baseline %s: %s', args.baseline, e)
+            sys.exit(1)
+
+    def rerun(runner):
+        copy = runner.copy()
+        copy.run(args.time_limit, args.memory_limit, args.wall_time_limit)
+        return copy
+
+    scoreboard = Scoreboard(fail_fast=args.fail_fast,
+                            baseline=baseline,
+                            rerun=rerun,
+                            reruns=args.regression_reruns,
+                            time_limit=args.time_limit,
+                            judge_time_limit=args.judge_time_limit)
+    run_history = history.History()
+    runners = []
+    examples = set()
+
+    try:
+        for test_case in tests:
+            runner = make_runner(test_case)
+            if args.repeat is not None and args.repeat > 1:
+                runner = RepeatedRunner(runner, args.repeat, args.repeat_policy)
+            runners.append(runner)
+            if test_case.example:
+                examples.add(runner)
+
+        # Expensive test cases are started first, but displayed in their
+        # natural order
+        futures = {}
+        order = scheduler.order_by_cost(runners, run_history)
+        if args.fail_fast:
+            order = scheduler.likely_failures_first(order, run_history, examples)
+        def submit(runner):
+            if args.engine == 'asyncio':
+                return executor.submit(runner, args.time_limit, args.memory_limit,
+                                       args.wall_time_limit)
+            return executor.submit(runner.run, args.time_limit, args.memory_limit,
+                                   args.wall_time_limit)
+        for runner in order:
+            if isinstance(runner, RepeatedRunner):
+                # The runs go to different workers
+                futures[runner] = RepeatedRunner.gather([submit(run) for run in runner.runners])
+            else:
+                futures[runner] = submit(runner)
+        for test_case, runner in zip(tests, runners):
+            scoreboard.add(test_case.infile, runner, futures[runner])
+
+        code = scoreboard.start()
+    except KeyboardInterrupt:
+        # Interrupted while still submitting test cases
+        scoreboard.abort()
+        for runner in runners:
+            runner.abort()
+        code = 128 + signal.SIGINT
     executor.shutdown()
+    checker.close()
+
+    run_history.record(args.executable, runners)
+    if args.record_baseline is not None:
+        Baseline.save(args.record_baseline, runners)
     sys.exit(code)
@@ -0,0 +1,171 @@
+'''cgroup v2 support for the Linux backend.
+
+Used with --cgroup only.  When the grader runs inside a delegated (writable) cgroup v2 subtree with
+the memory controller available, each child is placed in its own leaf cgroup.  This gives exact CPU
+and peak memory accounting that includes any descendants, and lets the kernel enforce the memory
+limit through memory.max.  Note that memory is then resident memory including page cache
+(memory.peak) rather than virtual memory (VmPeak), so verdicts can differ from the default.  When
+cgroups are not usable, create_leaf() returns None and the caller falls back to /proc polling.
+'''
+
+import errno
+import itertools
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+_lock = threading.Lock()
+_parent = False # not probed yet
+_counter = itertools.count()
+
+
+def _read(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+def _write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+def _cgroup2_mount():
+    with open('/proc/self/mounts', 'r') as mounts:
+        for line in mounts:
+            fields = line.split()
+            if len(fields) >= 3 and fields[2] == 'cgroup2':
+                return fields[1]
+    return None
+
+def _own_cgroup():
+    with open('/proc/self/cgroup', 'r') as f:
+        for line in f:
+            if line.startswith('0::'):
+                return line[3:].strip()
+    return None
+
+def _setup():
+    mount = _cgroup2_mount()
+    own = _own_cgroup()
+    if mount is None or own is None:
+        return None
+    base = os.path.join(mount, own.lstrip('/'))
+    if 'memory' not in _read(os.path.join(base, 'cgroup.controllers')).split():
+        return None
+
+    if 'memory' not in _read(os.path.join(base, 'cgroup.subtree_control')).split():
+        # A cgroup that contains processes cannot enable controllers for its
+        # children ("no internal processes" rule), so the grader first moves
+        # itself into a leaf of its own.  Only done if it is alone in there.
+        if _read(os.path.join(base, 'cgroup.procs')).split() != [str(os.getpid())]:
+            return None
+        supervisor = os.path.join(base, 'mini-grader.supervisor')
+        os.makedirs(supervisor, exist_ok=True)
+        _write(os.path.join(supervisor, 'cgroup.procs'), str(os.getpid()))
+        _write(os.path.join(base, 'cgroup.subtree_control'), '+memory')
+    return base
+
+def _parent_cgroup():
+    global _parent
+    with _lock:
+        if _parent is False:
+            try:
+                _parent = _setup()
+            except OSError:
+                _parent = None
+            if _parent:
+                logging.info('Using cgroup v2 accounting (resident memory) under %s', _parent)
+            else:
+                logging.warning('cgroup v2 not usable, falling back to /proc polling (VmPeak)')
+        return _parent
+
+def create_leaf():
+    '''Returns a new Leaf, or None if cgroups are not usable.'''
+    if not sys.platform.startswith('linux'):
+        return None
+    parent = _parent_cgroup()
+    if parent is None:
+        return None
+    try:
+        return Leaf(parent)
+    except OSError:
+        return None
+
+
+class Leaf:
+    '''A leaf cgroup holding a single child process (and its descendants).'''
+
+    def __init__(self, parent):
+        self.path = os.path.join(parent, 'mini-grader.%d.%d' % (os.getpid(), next(_counter)))
+        os.mkdir(self.path)
+        # Memory is accounted and limited as RAM, keep swap out of the picture
+        try:
+            self._write('memory.swap.max', '0')
+        except OSError:
+            pass
+        self._procs_path = self._path('cgroup.procs').encode()
+
+    def _path(self, name):
+        return os.path.join(self.path, name)
+
+    def _write(self, name, text):
+        _write(self._path(name), text)
+
+    def _read_keyed(self, name):
+        # Parses flat keyed files such as cpu.stat and memory.events
+        result = {}
+        for line in _read(self._path(name)).splitlines():
+            key, value = line.split()
+            result[key] = int(value)
+        return result
+
+    def enter(self):
+        '''Moves the calling process into this cgroup.  Meant to be run in the child before exec.'''
+        fd = os.open(self._procs_path, os.O_WRONLY)
+        try:
+            os.write(fd, b'0')
+        finally:
+            os.close(fd)
+
+    def set_memory_limit(self, limit):
+        self._write('memory.max', 'max' if limit is None or limit >= sys.maxsize else str(int(limit)))
+
+    def cpu_time(self):
+        return self._read_keyed('cpu.stat')['usage_usec'] / 1000000
+
+    def memory_peak(self):
+        '''Peak memory usage in bytes, or None if the kernel does not track it (< 5.19).'''
+        try:
+            return int(_read(self._path('memory.peak')))
+        except FileNotFoundError:
+            return None
+
+    def oom_killed(self):
+        return self._read_keyed('memory.events').get('oom_kill', 0) > 0
+
+    def kill(self):
+        try:
+            self._write('cgroup.kill', '1')
+        except FileNotFoundError:
+            # cgroup.kill is only available since Linux 5.14
+            for pid in _read(self._path('cgroup.procs')).split():
+                try: os.kill(int(pid), signal.SIGKILL)
+                except ProcessLookupError: pass
+
+    def remove(self):
+        '''Kills anything left in the cgroup and removes it.'''
+        try:
+            self.kill()
+            for _ in range(100):
+                try:
+                    os.rmdir(self.path)
+                    return
+                except OSError as e:
+                    if e.errno != errno.EBUSY:
+                        raise
+                # Killed processes take a moment to leave the cgroup
+                time.sleep(0.001)
+        except OSError:
+            pass
+        logging.info('Could not remove cgroup %s', self.path)
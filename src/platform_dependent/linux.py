@@ -1,25 +1,46 @@
+import functools
+import math
 import os
-import re
 import resource
+import signal
 import sys
+import threading
 import time
 
 from subprocess import Popen, PIPE
-from signal import SIGTERM
+from signal import SIGKILL, SIGTERM
+
+from . import cgroup
+from . import posix
+from . import supervisor
+from . import topology
+
+# Usage is sampled more often as a process approaches one of its limits,
+# within these bounds (in seconds).  Exits are noticed immediately regardless.
+MIN_SAMPLE_INTERVAL = 0.002
+MAX_SAMPLE_INTERVAL = 0.1
+# Memory can grow in a burst between two samples, so assume it may grow at
+# least this fast (bytes per second, roughly the page fault rate)
+MIN_MEMORY_GROWTH_RATE = 4 * 2**30
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# Bounds the cost of sampling solutions that fork wildly
+MAX_TRACKED_DESCENDANTS = 256
+
+# After abort(), time given to a process to exit on SIGTERM before SIGKILL
+ABORT_GRACE_PERIOD = 0.1
+
+_stack_limit_raised = False
 
 def cpu_count():
-    '''Linux-specific implementation that tries to figure out the number of physical cores from /proc/cpuinfo.'''
+    '''Linux-specific implementation that counts the physical cores this process may run on.'''
     result = None
     try:
-        with open('/proc/cpuinfo', 'r') as cpuinfo:
-            coreid_re = re.compile(r'core id\s*:\s*([^\s]+)')
-            coreids = set()
-            for line in cpuinfo:
-                match = coreid_re.match(line)
-                if match:
-                    coreids.add(match.group(1))
-        result = len(coreids)
-    except IOError:
+        result = len(topology.physical_cores())
+    except (OSError, AttributeError):
+        # No sched_getaffinity() on platforms merely treated as Linux
         pass
 
     if not result:
@@ -28,9 +49,22 @@ def cpu_count():
         result = multiprocessing.cpu_count()
     return result
 
+def available_memory():
+    '''Returns MemAvailable from /proc/meminfo in bytes, or None if unknown.'''
+    try:
+        with open('/proc/meminfo', 'r') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
 
 class lPopen (Popen):
-    '''Runs an executable, enforcing resource limits through periodic polling.'''
+    '''Runs an executable, enforcing resource limits through periodic polling.
+
+    The polling is done by the shared supervisor thread, lwait() only blocks until it is done.'''
 
 
     #
@@ -38,64 +72,352 @@ class lPopen (Popen):
     #
 
     def _kill (self):
-        try: os.kill(self.pid, SIGTERM)
+        # The process leads its own process group, so helpers it forked go
+        # down with it.  Until it is reaped, its PID (and so the group ID)
+        # cannot be recycled.
+        try: os.killpg(self.pid, SIGKILL)
+        except: pass
+        try:
+            if self._pidfd is not None:
+                # Signal through the pidfd so that a recycled PID can never be hit
+                signal.pidfd_send_signal(self._pidfd, SIGKILL)
+            else:
+                os.kill(self.pid, SIGKILL)
         except: pass
 
-    def _wrapped_read(self, path):
+    def _spawn(self, args, keywords, cpus):
+        # Without a preexec_fn, Popen starts the child with vfork() rather
+        # than fork(), whose cost grows with the size of the grader.  No code
+        # can run in the child then: the raised stack limit is inherited from
+        # the grader instead.
+        global _stack_limit_raised
+        if not _stack_limit_raised:
+            posix.raise_stack_limit()
+            _stack_limit_raised = True
+        if cpus is not None:
+            # The child inherits the affinity of the spawning thread, so it
+            # is pinned before it runs a single instruction
+            saved_cpus = os.sched_getaffinity(0)
+            os.sched_setaffinity(0, cpus)
         try:
-            with open(path, 'r') as f:
+            Popen.__init__(self, *args, start_new_session=True, **keywords)
+        finally:
+            if cpus is not None:
+                os.sched_setaffinity(0, saved_cpus)
+
+    def _open_pidfd(self):
+        try:
+            return os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            # Python < 3.9 or kernel < 5.3
+            return None
+
+    def _open_proc(self, name):
+        # Kept open for the lifetime of the process and read with pread()
+        try:
+            return os.open('/proc/%d/%s' % (self.pid, name), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+
+    def _close_fds(self):
+        for name in ('_pidfd', '_stat_fd', '_status_fd', '_children_fd'):
+            fd = getattr(self, name)
+            if fd is not None:
+                os.close(fd)
+                setattr(self, name, None)
+
+    def _watch_exit(self):
+        # Fallback exit notification when pidfds are unavailable.  Blocks in
+        # waitid() without reaping the child, so that it can still be sampled.
+        try:
+            os.waitid(os.P_PID, self.pid, os.WEXITED | os.WNOWAIT)
+        except ChildProcessError:
+            pass
+        finally:
+            self._exited.set()
+            supervisor.get().wake()
+
+    def _reap(self):
+        '''Reaps the process, taking the final CPU time and peak memory from its rusage.'''
+        _, status, rusage = os.wait4(self.pid, 0)
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+        if self.cgroup is None:
+            # Exact, unlike the sampled clock ticks, and includes descendants
+            # it waited for.  (The cgroup figure is exact too.)
+            self.time = max(self.time, rusage.ru_utime + rusage.ru_stime)
+        # ru_maxrss (in kilobytes) catches spikes between samples.  It also
+        # covers the child before exec, when it was a copy of the grader, so it
+        # only means something when above the grader's own peak.
+        if rusage.ru_maxrss > resource.getrusage(resource.RUSAGE_SELF).ru_maxrss:
+            self.vmpeak = max(self.vmpeak, rusage.ru_maxrss * 1024)
+        return self.returncode
+
+    def _pread(self, fd, size):
+        if fd is None:
+            return None
+        try:
+            return os.pread(fd, size, 0)
+        except ProcessLookupError:
+            return None
+
+    def _read_proc(self, pid, name):
+        # For descendants, which come and go
+        try:
+            with open('/proc/%d/%s' % (pid, name), 'rb') as f:
                 return f.read()
-        except IOError as e:
-            if e.errno == 2: # File not found
-                return None
-            raise
+        except (FileNotFoundError, ProcessLookupError):
+            return None
+
+    def _descendants(self):
+        '''Returns the PIDs of the live descendants of the process.'''
+        result = []
+        children = self._pread(self._children_fd, 4096)
+        while children and len(result) < MAX_TRACKED_DESCENDANTS:
+            pids = [int(pid) for pid in children.split()]
+            result.extend(pids)
+            children = b' '.join(filter(None, (self._read_proc(pid, 'task/%d/children' % pid)
+                                                for pid in pids)))
+        return result[:MAX_TRACKED_DESCENDANTS]
+
+    def _cpu_ticks(self, procstat):
+        # Own and waited-for children's utime, stime, cutime and cstime.  Only
+        # split as far as needed.
+        stats = procstat.rpartition(b")")[2].split(None, 15)
+        return int(stats[11]) + int(stats[12]) + int(stats[13]) + int(stats[14])
+
+    def _refresh_time(self, descendants):
+        procstat = self._pread(self._stat_fd, 1024)
+        if procstat:
+            ticks = self._cpu_ticks(procstat)
+            for pid in descendants:
+                procstat = self._read_proc(pid, 'stat')
+                if procstat:
+                    ticks += self._cpu_ticks(procstat)
+            self.time = max(self.time, ticks / CLOCK_TICKS)
+
+    def _refresh_memory(self, descendants=()):
+        procstatus = self._pread(self._status_fd, 8192)
+        if procstatus:
+            start = procstatus.find(b"VmPeak:")
+            if start < 0: # No entries
+                return
+            vmpeak = int(procstatus[start+7:procstatus.index(b"kB", start)]) * 1024
+            if descendants:
+                # No peak is kept for a whole tree, the best we have is the
+                # sum of current sizes
+                start = procstatus.find(b"VmSize:")
+                size = int(procstatus[start+7:procstatus.index(b"kB", start)]) * 1024
+                for pid in descendants:
+                    statm = self._read_proc(pid, 'statm')
+                    if statm:
+                        size += int(statm.split(None, 1)[0]) * PAGE_SIZE
+                vmpeak = max(vmpeak, size)
+            if vmpeak <= 2**40:
+                self.vmpeak = max(self.vmpeak, vmpeak)
+            else:
+                # Probably dealing with an ASAN binary, do not report
+                # memory usage
+                self.vmpeak = 0
 
     def _refresh_usage (self):
-        procstat = self._wrapped_read('/proc/%d/stat' % self.pid)
-        if procstat is not None:
-            stats = procstat.split(")")[1].split()
-            self.time = max(self.time, int(stats[11]) + int(stats[12])) / 100
-
-        procstatus = self._wrapped_read('/proc/%d/status' % self.pid)
-        if procstatus is not None:
-            tokens = procstatus.split()
-            try:
-                vmpeak = int(tokens[tokens.index("VmPeak:")+1]) * 1024
-                if vmpeak <= 2**40:
-                    self.vmpeak = vmpeak
-                else:
-                    # Probably dealing with an ASAN binary, do not report
-                    # memory usage
-                    self.vmpeak = 0
-
-            except ValueError: # No entries
-                pass
+        if self.cgroup is None:
+            descendants = self._descendants()
+            self._refresh_time(descendants)
+            self._refresh_memory(descendants)
+            return
+        # The cgroup also accounts for any descendants
+        self.time = max(self.time, self.cgroup.cpu_time())
+        peak = self.cgroup.memory_peak()
+        if peak is not None:
+            self.vmpeak = max(self.vmpeak, peak)
+        else:
+            self._refresh_memory()
+
+    def _sample_interval(self, now, dt, dtime, dmemory):
+        # Estimate how soon each limit could be reached at the current rates,
+        # and sample again halfway there
+        tlimit, mlimit, wlimit = self._limits
+        remaining = [MAX_SAMPLE_INTERVAL]
+        if tlimit is not None:
+            cpu_rate = max(dtime / dt, 1) if dt > 0 else 1
+            remaining.append((tlimit - self.time) / cpu_rate)
+        if mlimit is not None and not self._memory_enforced:
+            memory_rate = max(dmemory / dt, MIN_MEMORY_GROWTH_RATE) if dt > 0 else MIN_MEMORY_GROWTH_RATE
+            remaining.append((mlimit - self.vmpeak) / memory_rate)
+        if wlimit is not None:
+            remaining.append(self.start_time + wlimit - now)
+        return min(MAX_SAMPLE_INTERVAL, max(MIN_SAMPLE_INTERVAL, min(remaining) / 2))
+
+    def _check_limits(self, now):
+        tlimit, mlimit, wlimit = self._limits
+        self.timeout = tlimit is not None and self.time > tlimit
+        self.memout = mlimit is not None and self.vmpeak > mlimit
+        self.idleout = wlimit is not None and now - self.start_time > wlimit
+        return self.timeout or self.memout or self.idleout
+
+    #
+    # Supervisor callbacks
+    #
+
+    def exit_fd(self):
+        return self._pidfd
+
+    def has_exited(self):
+        return self._exited is not None and self._exited.is_set()
+
+    def sample(self, now):
+        if self._abort_time is not None and not self._killed:
+            if now < self._abort_time + ABORT_GRACE_PERIOD:
+                self.next_sample = self._abort_time + ABORT_GRACE_PERIOD
+                return
+            self._killed = True
+            self._kill()
+        if self._killed:
+            # Already over a limit, waiting for the process to die
+            self.next_sample = math.inf
+            return
+        last_time, last_memory, last_now = self.time, self.vmpeak, self._last_sample
+        self.next_sample = now + MAX_SAMPLE_INTERVAL
+        self._refresh_usage()
+        self._last_sample = now
+        if self._check_limits(now):
+            self._killed = True
+            self._kill()
+            return
+        self.next_sample = now + self._sample_interval(now, now - last_now, self.time - last_time,
+                                                       self.vmpeak - last_memory)
+
+    def finish(self):
+        try:
+            tlimit, mlimit, wlimit = self._limits
+            self._refresh_usage()
+            with self._reap_lock:
+                self._kill()
+                self.exitcode = self._reap()
+            if self.cgroup is not None:
+                self._refresh_usage()
+                self.memout = self.memout or self.cgroup.oom_killed()
+                # Removing the cgroup waits for stragglers to leave it, which
+                # would hold up the sampling of every other child
+                threading.Thread(target=self.cgroup.remove).start()
+
+            # Judge by the exact final numbers, so that tests finishing just past a
+            # limit between two samples are not let through
+            if not (self.timeout or self.memout or self.idleout):
+                self.timeout = tlimit is not None and self.time > tlimit
+                self.memout = mlimit is not None and self.vmpeak > mlimit
+            if self.kernel_limits and not (self.timeout or self.memout or self.idleout):
+                # Map deaths caused by the rlimits back onto limit verdicts
+                self.timeout = posix.killed_by_cpu_limit(self.exitcode)
+                self.memout = (not self.timeout and mlimit is not None and
+                               posix.killed_by_memory_limit(self.exitcode, self.vmpeak, mlimit))
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._close_fds()
+            self._done.set()
+            if self._callback is not None:
+                self._callback(self._error)
 
     #
     # Generic methods
     #
 
-    def __init__ (self, *args, **keywords):
+    def __init__ (self, *args, cpu_limit=None, memory_limit=None, cpus=None, use_cgroup=False,
+                  cgroup_memory_limit=None, **keywords):
+        '''If `cpu_limit' or `memory_limit' are given, they are also enforced by the kernel
+        through setrlimit() in the child.  If `cpus' is given, the process is pinned to those
+        logical CPUs.  If `use_cgroup' is true, the process is accounted through a cgroup of its
+        own when possible, which measures resident memory (including page cache) rather than
+        VmPeak, and limited to `cgroup_memory_limit' by it from the start.'''
         self.time = 0
         self.vmpeak = 0
         self.timeout = False
         self.memout = False
+        self.idleout = False
+        self.aborted = False
         self.path = args[0]
+        self.kernel_limits = cpu_limit is not None or memory_limit is not None
 
-        # Raise stack limit as high as it goes (hopefully unlimited)
-        soft, hard = resource.getrlimit(resource.RLIMIT_STACK)
-        resource.setrlimit(resource.RLIMIT_STACK, (hard, hard))
+        # Use a cgroup of its own for accounting if asked to and possible
+        self.cgroup = cgroup.create_leaf() if use_cgroup else None
+        hooks = [self.cgroup.enter] if self.cgroup is not None else []
+        if cpus is not None:
+            hooks.append(functools.partial(os.sched_setaffinity, 0, cpus))
+        self._memory_enforced = self.kernel_limits or self.cgroup is not None
 
         # Now start the process
-        Popen.__init__(self, *args, **keywords)
+        try:
+            if self.cgroup is not None:
+                # Before the child runs, so that no early burst gets past it
+                self.cgroup.set_memory_limit(cgroup_memory_limit)
+            if self.kernel_limits or self.cgroup is not None:
+                # The stack limit is raised and the limits applied in the
+                # child, just before exec
+                keywords['preexec_fn'] = posix.child_setup(cpu_limit, memory_limit, hooks=hooks)
+                Popen.__init__(self, *args, start_new_session=True, **keywords)
+            else:
+                self._spawn(args, keywords, cpus)
+        except:
+            if self.cgroup is not None:
+                self.cgroup.remove()
+            raise
+        self.start_time = time.monotonic()
 
-    def lwait (self, tlimit, mlimit):
-        self._refresh_usage()
-        while self.poll() is None and not (self.timeout or self.memout):
-            self._refresh_usage()
-            self.timeout = tlimit is not None and self.time > tlimit
-            self.memout = mlimit is not None and self.vmpeak > mlimit
-            time.sleep(0.01)
+        self._limits = (None, None, None)
+        self._last_sample = self.start_time
+        self._killed = False
+        self._abort_time = None
+        self._reap_lock = threading.Lock()
+        self._done = threading.Event()
+        self._error = None
+        self._callback = None
+        self.next_sample = math.inf
+        self._stat_fd = self._open_proc('stat')
+        self._status_fd = self._open_proc('status')
+        # Needs CONFIG_PROC_CHILDREN, without it descendants are not tracked
+        self._children_fd = self._open_proc('task/%d/children' % self.pid)
+
+        # Set up exit notification, preferring a pidfd
+        self._exited = None
+        self._pidfd = self._open_pidfd()
+        if self._pidfd is None:
+            self._exited = threading.Event()
+            threading.Thread(target=self._watch_exit, daemon=True).start()
+
+    def lwatch(self, tlimit, mlimit, wlimit, callback):
+        '''Non-blocking lwait().  `callback' is called from the supervisor thread once the process
+        is done, with the exception raised while finishing it or None.'''
+        self._callback = callback
+        self._limits = (tlimit, mlimit, wlimit)
+        self.next_sample = time.monotonic()
+        if self._abort_time is not None:
+            self.next_sample = self._abort_time + ABORT_GRACE_PERIOD
+        supervisor.get().watch(self)
+
+    def abort(self):
+        '''Stops the process: SIGTERM now, SIGKILL after a short grace period.  Thread-safe.'''
+        with self._reap_lock:
+            if self._abort_time is not None or self.returncode is not None:
+                return
+            self._abort_time = time.monotonic()
+            self.aborted = True
+            try: os.killpg(self.pid, SIGTERM)
+            except: pass
+        self.next_sample = min(self.next_sample, self._abort_time + ABORT_GRACE_PERIOD)
+        supervisor.get().wake()
+
+    def usage(self):
+        '''Returns the CPU time and peak memory of the process so far, for a process that is
+        talked to rather than waited for with lwait().'''
         self._refresh_usage()
-        self._kill()
-        self.exitcode = self.wait()
+        return self.time, self.vmpeak
+
+    def lwait (self, tlimit, mlimit, wlimit=None):
+        self.lwatch(tlimit, mlimit, wlimit, None)
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,73 @@
+import math
+import os
+import resource
+import signal
+import sys
+
+# With kernel-enforced limits, a crash is attributed to the memory limit only
+# if the process was seen using at least this fraction of it
+MEMORY_LIMIT_SLACK = 0.9
+
+# The ways RLIMIT_AS kills a process: abort() after a failed allocation
+# (std::bad_alloc, malloc checks) or a segfault when the stack cannot grow
+MEMORY_LIMIT_SIGNALS = (signal.SIGSEGV, signal.SIGABRT, signal.SIGBUS)
+
+def _set_rlimit(which, soft, hard):
+    # Never try to go above the inherited hard limit, which would fail
+    _, max_hard = resource.getrlimit(which)
+    if max_hard != resource.RLIM_INFINITY:
+        soft = min(soft, max_hard)
+        hard = min(hard, max_hard)
+    resource.setrlimit(which, (soft, hard))
+
+def raise_stack_limit():
+    # Raise stack limit as high as it goes (hopefully unlimited)
+    soft, hard = resource.getrlimit(resource.RLIMIT_STACK)
+    resource.setrlimit(resource.RLIMIT_STACK, (hard, hard))
+
+def _physical_memory():
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def kernel_memory_limit(memory_limit):
+    '''Returns the address space limit to set for `memory_limit'.
+
+    Allocations beyond RLIMIT_AS fail on the spot, usually ending in abort() with the peak still
+    small, where polling would have seen them succeed and given a memory limit verdict.  So the
+    kernel limit leaves room for anything that fits in physical memory on top of the limit,
+    keeping the verdicts the same as without it.'''
+    physical = _physical_memory()
+    return memory_limit + (physical if physical else memory_limit)
+
+def child_setup(cpu_limit, memory_limit, raise_stack=True, hooks=()):
+    '''Returns a preexec_fn that applies resource limits in the child before exec.
+
+    The CPU limit is rounded up to whole seconds (the granularity of RLIMIT_CPU) and the memory
+    limit raised by kernel_memory_limit(); both act as backstops, the exact limits are still
+    checked by the parent.  `hooks' are extra callables run first.'''
+    if memory_limit is not None and memory_limit < sys.maxsize:
+        address_space = int(kernel_memory_limit(memory_limit))
+    else:
+        address_space = None
+    def setup():
+        for hook in hooks:
+            hook()
+        if raise_stack:
+            raise_stack_limit()
+        if cpu_limit is not None and cpu_limit < sys.maxsize:
+            seconds = max(1, int(math.ceil(cpu_limit)))
+            # SIGXCPU at the soft limit, SIGKILL one second later
+            _set_rlimit(resource.RLIMIT_CPU, seconds, seconds + 1)
+        if address_space is not None:
+            _set_rlimit(resource.RLIMIT_AS, address_space, address_space)
+    return setup
+
+def killed_by_cpu_limit(returncode):
+    return returncode == -signal.SIGXCPU
+
+def killed_by_memory_limit(returncode, vmpeak, memory_limit):
+    # Ordinary nonzero exit codes are runtime errors, whatever the memory use
+    return (returncode is not None and -returncode in MEMORY_LIMIT_SIGNALS and
+            vmpeak >= MEMORY_LIMIT_SLACK * memory_limit)
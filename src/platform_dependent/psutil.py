@@ -1,6 +1,7 @@
+import functools
+import logging
 import os
 import psutil
-import resource
 import signal
 import sys
 import threading
@@ -8,35 +9,60 @@ import time
 
 from subprocess import Popen, PIPE
 
+from . import posix
+
+@functools.lru_cache(maxsize=None)
+def _warn_no_cgroup():
+    # Once per run
+    logging.warning('cgroup v2 not usable with psutil, falling back to polling (VmSize)')
+
 def cpu_count():
     return psutil.cpu_count(logical=False)
 
+def available_memory():
+    return psutil.virtual_memory().available
+
 class lPopen(Popen):
     '''Runs an executable, enforcing resource limits through periodic polling.'''
 
-    def __init__(self, *args, **keywords):
+    def __init__(self, *args, cpu_limit=None, memory_limit=None, cpus=None, use_cgroup=False,
+                 cgroup_memory_limit=None, **keywords):
         self.time = 0
         self.vmpeak = 0
         self.timeout = False
         self.memout = False
+        self.idleout = False
         self._aborted = False
+        self.aborted = False
         self._abort_lock = threading.Lock()
         self._abort_cv = threading.Condition(self._abort_lock)
         self.on_osx = sys.platform.startswith('darwin')
+        self.kernel_limits = cpu_limit is not None or memory_limit is not None
+
+        if use_cgroup:
+            # cgroup accounting is only implemented by the Linux backend
+            _warn_no_cgroup()
+        hooks = []
+        if cpus is not None:
+            hooks.append(functools.partial(os.sched_setaffinity, 0, cpus))
 
-        self._set_stack_limit()
+        # TODO: investigate the stack limit on OSX
+        keywords['preexec_fn'] = posix.child_setup(cpu_limit, memory_limit,
+                                                   raise_stack=not self.on_osx, hooks=hooks)
 
         # Now start the process
-        Popen.__init__(self, *args, **keywords)
+        Popen.__init__(self, *args, start_new_session=True, **keywords)
+        self.start_time = time.monotonic()
 
         self.psutil_process = psutil.Process(self.pid)
 
-    def lwait(self, tlimit, mlimit):
+    def lwait(self, tlimit, mlimit, wlimit=None):
         self._refresh_usage()
-        while self.poll() is None and not (self.timeout or self.memout):
+        while self.poll() is None and not (self.timeout or self.memout or self.idleout):
             self._refresh_usage()
             self.timeout = tlimit is not None and self.time > tlimit
             self.memout = mlimit is not None and self.vmpeak > mlimit
+            self.idleout = wlimit is not None and time.monotonic() - self.start_time > wlimit
             with self._abort_lock:
                 if self._aborted:
                     break
@@ -44,38 +70,58 @@ class lPopen(Popen):
         self._refresh_usage()
         self._kill()
         self.exitcode = self.wait()
+        if self.kernel_limits and not (self.timeout or self.memout or self.idleout):
+            # Map deaths caused by the rlimits back onto limit verdicts
+            self.timeout = (posix.killed_by_cpu_limit(self.exitcode) or
+                            tlimit is not None and self.time > tlimit)
+            self.memout = (not self.timeout and mlimit is not None and
+                           posix.killed_by_memory_limit(self.exitcode, self.vmpeak, mlimit))
+
+    def usage(self):
+        '''Returns the CPU time and peak memory of the process so far, for a process that is
+        talked to rather than waited for with lwait().'''
+        self._refresh_usage()
+        return self.time, self.vmpeak
 
     def abort(self):
         with self._abort_lock:
             self._aborted = True
+            self.aborted = True
             self._abort_cv.notify()
 
     def _refresh_usage(self):
+        # Sums over the process and its descendants; children_* cover the
+        # descendants that were already waited for
         try:
-            with self.psutil_process.oneshot():
-                times = self.psutil_process.cpu_times()
-                self.time = max(self.time, times.user + times.system)
-
-                mems = self.psutil_process.memory_info()
-                # With psutil 5.1.3 / OSX 10.13 mems.vms is garbage, use `rss'
-                # instead on OSX
-                current_mem = mems.rss if self.on_osx else mems.vms
-                if current_mem <= 2**40:
-                    self.vmpeak = max(self.vmpeak, current_mem)
-                else:
-                    # Probably dealing with an ASAN binary, do not report
-                    # memory usage
-                    self.vmpeak = 0
+            total_time = 0
+            total_mem = 0
+            for process in [self.psutil_process] + self.psutil_process.children(recursive=True):
+                try:
+                    with process.oneshot():
+                        times = process.cpu_times()
+                        total_time += (times.user + times.system +
+                                       times.children_user + times.children_system)
+                        mems = process.memory_info()
+                        # With psutil 5.1.3 / OSX 10.13 mems.vms is garbage, use
+                        # `rss' instead on OSX
+                        total_mem += mems.rss if self.on_osx else mems.vms
+                except psutil.NoSuchProcess:
+                    if process is self.psutil_process:
+                        raise
+            self.time = max(self.time, total_time)
+            if total_mem <= 2**40:
+                self.vmpeak = max(self.vmpeak, total_mem)
+            else:
+                # Probably dealing with an ASAN binary, do not report
+                # memory usage
+                self.vmpeak = 0
         except psutil.NoSuchProcess:
             pass
 
     def _kill(self):
+        # The process leads its own process group, so helpers it forked go
+        # down with it
+        try: os.killpg(self.pid, signal.SIGKILL)
+        except: pass
         try: os.kill(self.pid, signal.SIGKILL)
         except: pass
-
-    def _set_stack_limit(self):
-        # TODO: investigate this on OSX
-        if not self.on_osx:
-            # Raise stack limit as high as it goes (hopefully unlimited)
-            soft, hard = resource.getrlimit(resource.RLIMIT_STACK)
-            resource.setrlimit(resource.RLIMIT_STACK, (hard, hard))
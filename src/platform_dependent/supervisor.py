@@ -0,0 +1,104 @@
+'''A single thread that watches all running children of the Linux backend.
+
+Instead of every lwait() spinning in its own sampling loop, the supervisor waits for exit
+notifications (pidfds) of all children at once and samples each child only when it is due.  The
+per-child work (sampling, limit checks, reaping) is done by the lPopen callbacks:
+
+    exit_fd()        fd that becomes readable when the child exits, or None
+    has_exited()     for children without an exit_fd()
+    next_sample      monotonic time at which sample() should next be called
+    sample(now)      refreshes usage and enforces limits
+    finish()         reaps the child and signals its waiter
+'''
+
+import logging
+import math
+import os
+import select
+import threading
+import time
+
+_instance = None
+_instance_lock = threading.Lock()
+
+def get():
+    '''Returns the supervisor, starting it if needed.'''
+    global _instance
+    with _instance_lock:
+        if _instance is None:
+            _instance = Supervisor()
+        return _instance
+
+
+class Supervisor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._thread = threading.Thread(target=self._loop, name='lPopen supervisor', daemon=True)
+        self._thread.start()
+
+    def watch(self, process):
+        with self._lock:
+            self._pending.append(process)
+        self.wake()
+
+    def wake(self):
+        '''Makes the supervisor re-examine its children, e.g. after an exit or an abort.'''
+        try:
+            os.write(self._wake_w, b'.')
+        except BlockingIOError:
+            # Pipe is full, so a wakeup is pending anyway
+            pass
+
+    def _drain(self):
+        try:
+            while os.read(self._wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _loop(self):
+        poller = select.poll()
+        poller.register(self._wake_r, select.POLLIN)
+        watched = set()
+        by_fd = {}
+        while True:
+            with self._lock:
+                new, self._pending = self._pending, []
+            for process in new:
+                watched.add(process)
+                fd = process.exit_fd()
+                if fd is not None:
+                    by_fd[fd] = process
+                    poller.register(fd, select.POLLIN)
+
+            next_sample = min([process.next_sample for process in watched] + [math.inf])
+            if next_sample == math.inf:
+                timeout = None
+            else:
+                timeout = max(0, math.ceil((next_sample - time.monotonic()) * 1000))
+
+            exited = set()
+            for fd, _ in poller.poll(timeout):
+                if fd == self._wake_r:
+                    self._drain()
+                else:
+                    exited.add(by_fd[fd])
+
+            now = time.monotonic()
+            for process in list(watched):
+                try:
+                    if process in exited or process.has_exited():
+                        fd = process.exit_fd()
+                        if fd is not None:
+                            poller.unregister(fd)
+                            del by_fd[fd]
+                        watched.discard(process)
+                        process.finish()
+                    elif process.next_sample <= now:
+                        process.sample(now)
+                except Exception:
+                    logging.exception('Error while supervising %s', process)
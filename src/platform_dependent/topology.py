@@ -0,0 +1,81 @@
+'''CPU topology from /sys/devices/system/cpu (Linux), and pinning of test cases to physical cores.'''
+
+import collections
+import glob
+import os
+import re
+import threading
+
+SYSFS_CPU = '/sys/devices/system/cpu'
+SYSFS_NODE = '/sys/devices/system/node'
+
+Core = collections.namedtuple('Core', ['node', 'package', 'die', 'core', 'cpus'])
+
+
+def _read_int(path, default):
+    try:
+        with open(path, 'r') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return default
+
+def parse_cpu_list(text):
+    '''Parses lists like "0-3,8,10-11" into a list of CPU numbers.'''
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+def _numa_nodes():
+    result = {}
+    for path in glob.glob(os.path.join(SYSFS_NODE, 'node[0-9]*', 'cpulist')):
+        node = int(re.search(r'node(\d+)', path).group(1))
+        with open(path, 'r') as f:
+            for cpu in parse_cpu_list(f.read()):
+                result[cpu] = node
+    return result
+
+def physical_cores():
+    '''Returns the physical cores this process may run on, each with its logical CPUs (SMT
+    siblings), ordered by NUMA node, package and core.'''
+    nodes = _numa_nodes()
+    cores = collections.OrderedDict()
+    for cpu in sorted(os.sched_getaffinity(0)):
+        base = os.path.join(SYSFS_CPU, 'cpu%d' % cpu, 'topology')
+        # core_id is only unique within a package (and die)
+        package = _read_int(os.path.join(base, 'physical_package_id'), 0)
+        die = _read_int(os.path.join(base, 'die_id'), 0)
+        core = _read_int(os.path.join(base, 'core_id'), cpu)
+        cores.setdefault((nodes.get(cpu, 0), package, die, core), []).append(cpu)
+    return sorted(Core(*(key + (tuple(cpus),))) for key, cpus in cores.items())
+
+
+class CpuSlots:
+    '''Hands out one physical core to each running test case, pinning it to the first logical CPU
+    of the core so that its SMT siblings stay idle.  With more test cases than cores, the least
+    loaded core is shared.'''
+
+    def __init__(self, cores=None):
+        self.cores = cores if cores is not None else physical_cores()
+        self._load = [0] * len(self.cores)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.cores)
+
+    def acquire(self):
+        '''Returns the logical CPU to pin the next test case to.'''
+        with self._lock:
+            index = min(range(len(self.cores)), key=self._load.__getitem__)
+            self._load[index] += 1
+            return self.cores[index].cpus[0]
+
+    def release(self, cpu):
+        with self._lock:
+            for index, core in enumerate(self.cores):
+                if core.cpus[0] == cpu:
+                    self._load[index] -= 1
+                    return
@@ -11,22 +11,30 @@ from signal import SIGTERM
 def cpu_count():
     return multiprocessing.cpu_count()
 
+def available_memory():
+    '''Returns the physical memory available for new processes in bytes, or None if unknown.'''
+    info = PERFORMANCE_INFORMATION()
+    info.cb = ctypes.sizeof(info)
+    if not ctypes.windll.psapi.GetPerformanceInfo(ctypes.byref(info), info.cb):
+        return None
+    return info.PhysicalAvailable * info.PageSize
+
 
 class PERFORMANCE_INFORMATION(ctypes.Structure):
-    _fields = [("cb", ctypes.c_int32),
-               ("CommitTotal", ctypes.c_size_t),
-               ("CommitLimit", ctypes.c_size_t),
-               ("CommitPeak", ctypes.c_size_t),
-               ("PhysicalTotal", ctypes.c_size_t),
-               ("PhysicalAvailable", ctypes.c_size_t),
-               ("SystemCache", ctypes.c_size_t),
-               ("KernelTotal", ctypes.c_size_t),
-               ("KernelPaged", ctypes.c_size_t),
-               ("KernelNonpaged", ctypes.c_size_t),
-               ("PageSize", ctypes.c_size_t),
-               ("HandleCount", ctypes.c_int32),
-               ("ProcessCount", ctypes.c_int32),
-               ("Threadcount", ctypes.c_int32)]
+    _fields_ = [("cb", ctypes.c_int32),
+                ("CommitTotal", ctypes.c_size_t),
+                ("CommitLimit", ctypes.c_size_t),
+                ("CommitPeak", ctypes.c_size_t),
+                ("PhysicalTotal", ctypes.c_size_t),
+                ("PhysicalAvailable", ctypes.c_size_t),
+                ("SystemCache", ctypes.c_size_t),
+                ("KernelTotal", ctypes.c_size_t),
+                ("KernelPaged", ctypes.c_size_t),
+                ("KernelNonpaged", ctypes.c_size_t),
+                ("PageSize", ctypes.c_size_t),
+                ("HandleCount", ctypes.c_int32),
+                ("ProcessCount", ctypes.c_int32),
+                ("Threadcount", ctypes.c_int32)]
                
 class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
     _fields_ = [("cb", ctypes.c_int32),
@@ -79,23 +87,41 @@ class lPopen (Popen):
     # Generic methods
     # 
     
-    def __init__ (self, *args, **keywords):
+    def __init__ (self, *args, cpu_limit=None, memory_limit=None, cpus=None, use_cgroup=False,
+                  cgroup_memory_limit=None, **keywords):
+        # Kernel-enforced limits, cgroups and CPU pinning are not implemented
+        # on Windows, the limits are only enforced through polling
         self.time = 0
         self.vmpeak = 0
         self.timeout = False
         self.memout = False
+        self.idleout = False
+        self.aborted = False
         self.path = args[0]
         Popen.__init__(self, *args, **keywords)
+        self.start_time = time.monotonic()
         PROCESS_QUERY_INFORMATION = 0x0400
         PROCESS_VM_READ = 0x0010
         self.hProcess = ctypes.windll.kernel32.OpenProcess(PROCESS_QUERY_INFORMATION | PROCESS_VM_READ, False, self.pid)
         
-    def lwait (self, tlimit, mlimit):
+    def usage(self):
+        '''Returns the CPU time and peak memory of the process so far, for a process that is
+        talked to rather than waited for with lwait().'''
+        self._refresh_usage()
+        return self.time, self.vmpeak
+
+    def abort(self):
+        self.aborted = True
+        self._kill()
+
+    def lwait (self, tlimit, mlimit, wlimit=None):
         self._refresh_usage()
-        while self.poll() is None and not (self.timeout or self.memout):
+        while self.poll() is None and not (self.timeout or self.memout or self.idleout or
+                                           self.aborted):
             self._refresh_usage()
             self.timeout = tlimit is not None and self.time > tlimit
             self.memout = mlimit is not None and self.vmpeak > mlimit
+            self.idleout = wlimit is not None and time.monotonic() - self.start_time > wlimit
             time.sleep(0.01)
         self._refresh_usage()
         self._kill()
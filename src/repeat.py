@@ -0,0 +1,128 @@
+import array
+import concurrent.futures
+import statistics
+import threading
+
+from . import stats
+from .runner import Runner
+
+class RepeatedRunner:
+    '''Runs a test case several times and presents the runs like a single Runner: the time is
+    the median over all runs and the memory the maximum.
+
+    Each run is a Runner of its own, in `runners', so the runs can be spread over workers.  The
+    verdict follows `policy' for verdicts that depend on timing (time and idle limits): 'median'
+    gives them if they happened in more than half of the runs, 'any' if they happened in any run
+    and 'all' only if they happened in all runs.  Any other failure is never noise and always
+    counts.'''
+
+    POLICIES = ('median', 'any', 'all')
+    TIMING_RESULTS = (Runner.Result.TIME_LIMIT, Runner.Result.IDLE_LIMIT)
+
+    def __init__(self, runner, repeat, policy='median'):
+        self.runners = [runner.copy(cache=None) for _ in range(repeat)]
+        self.policy = policy
+        self.task_name = runner.task_name
+        self.inpath = runner.inpath
+        self.cached = False
+
+    def copy(self, **changes):
+        return RepeatedRunner(self.runners[0].copy(**changes), len(self.runners), self.policy)
+
+    def run(self, time_limit, memory_limit, wall_time_limit=None):
+        for runner in self.runners:
+            runner.run(time_limit, memory_limit, wall_time_limit)
+
+    def abort(self):
+        for runner in self.runners:
+            runner.abort()
+
+    @property
+    def aborted(self):
+        return any(runner.aborted for runner in self.runners)
+
+    @property
+    def status(self):
+        statuses = [runner.status for runner in self.runners]
+        if all(status == Runner.DONE for status in statuses):
+            return Runner.DONE
+        if all(status == Runner.WAITING for status in statuses):
+            return Runner.WAITING
+        return Runner.RUNNING
+
+    @property
+    def result(self):
+        results = [runner.result for runner in self.runners]
+        for result in results:
+            if result not in self.TIMING_RESULTS + (Runner.Result.PASSED,
+                                                    Runner.Result.PRESENTATION_ERROR):
+                return result
+        for result in self.TIMING_RESULTS:
+            count = results.count(result)
+            if (count and self.policy == 'any' or count == len(results) or
+                    self.policy == 'median' and count > len(results) / 2):
+                return result
+        passed = [result for result in results if result not in self.TIMING_RESULTS]
+        if not passed:
+            return max(results, key=results.count)
+        return max(passed)
+
+    @property
+    def message(self):
+        messages = [runner.message for runner in self.runners if runner.message is not None]
+        return messages[0] if messages else None
+
+    @property
+    def checker_time(self):
+        times = [runner.checker_time for runner in self.runners if runner.checker_time is not None]
+        return max(times) if times else None
+
+    @property
+    def checker_memory(self):
+        memories = [runner.checker_memory for runner in self.runners
+                    if runner.checker_memory is not None]
+        return max(memories) if memories else None
+
+    def _samples(self, get):
+        # Compact, as there may be many runs of many test cases
+        return array.array('d', [get(runner) for runner in self.runners
+                                 if runner.status == Runner.DONE and
+                                 runner.result != Runner.Result.CANCELLED])
+
+    def get_times(self):
+        return self._samples(Runner.get_time)
+
+    def get_time(self):
+        times = self.get_times()
+        return statistics.median(times) if times else 0
+
+    def get_time_spread(self):
+        '''Returns the standard deviation of the times of the finished runs.'''
+        return stats.spread(self.get_times())
+
+    def get_memory(self):
+        memories = self._samples(Runner.get_memory)
+        return max(memories) if memories else 0
+
+    @staticmethod
+    def gather(futures):
+        '''Returns a future that is done when all `futures' are.  It cannot be cancelled, as the
+        runs it waits for are stopped through abort() instead.'''
+        gathered = concurrent.futures.Future()
+        gathered.set_running_or_notify_cancel()
+        remaining = [len(futures)]
+        lock = threading.Lock()
+        def on_done(future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            errors = [future.exception() for future in futures
+                      if not future.cancelled() and future.exception() is not None]
+            if errors:
+                gathered.set_exception(errors[0])
+            else:
+                gathered.set_result(None)
+        for future in futures:
+            future.add_done_callback(on_done)
+        return gathered
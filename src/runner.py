@@ -1,3 +1,6 @@
+import asyncio
+import contextlib
+import functools
 import os
 import shutil
 import subprocess
@@ -17,95 +20,293 @@ class Runner:
         MEMORY_LIMIT = 4
         RUNTIME_ERROR = 5
         PRESENTATION_ERROR = 6
+        IDLE_LIMIT = 7
+        CANCELLED = 8
+        CHECKER_ERROR = 9
 
     WAITING = 1
     RUNNING = 2
     CHECKING = 3
     DONE = 4
 
-    def __init__(self, task_name, executable, inpath, refoutpath, checker, usaco_style_io):
+    def __init__(self, task_name, executable, inpath, refoutpath, checker, usaco_style_io,
+                 kernel_limits=False, cpu_slots=None, admission=None, cache=None, fresh=False,
+                 run_slots=None, cgroup=False):
         self.task_name = task_name
         self.executable = executable
         self.inpath = inpath
         self.refoutpath = refoutpath
         self.checker = checker
         self.usaco_style_io = usaco_style_io
+        self.kernel_limits = kernel_limits
+        self.cpu_slots = cpu_slots
+        self.admission = admission
+        self.cache = cache
+        self.fresh = fresh
+        self.run_slots = run_slots
+        self.cgroup = cgroup
+        self.cached = False
+        self.message = None
+        self.checker_time = None
+        self.checker_memory = None
+        self._verdict_key = None
+        self._cpu = None
+        self._run_slot = False
         self._aborted = False
         self._abort_lock = threading.Lock()
 
         self.lpopen = None
         self.status = Runner.WAITING
 
-    def run(self, time_limit, memory_limit):
-        if not self.usaco_style_io:
-            self._run_with_normal_io(time_limit, memory_limit)
-        else:
-            self._run_with_usaco_io(time_limit, memory_limit)
+    def copy(self, **changes):
+        '''Returns a new runner for the same test case, e.g. to measure it again.  Keyword
+        arguments override those of this runner.'''
+        keywords = dict(task_name=self.task_name, executable=self.executable, inpath=self.inpath,
+                        refoutpath=self.refoutpath, checker=self.checker,
+                        usaco_style_io=self.usaco_style_io, kernel_limits=self.kernel_limits,
+                        cpu_slots=self.cpu_slots, admission=self.admission, cache=self.cache,
+                        fresh=True, run_slots=self.run_slots, cgroup=self.cgroup)
+        keywords.update(changes)
+        return Runner(**keywords)
+
+    @property
+    def aborted(self):
+        return self._aborted
+
+    def run(self, time_limit, memory_limit, wall_time_limit=None):
+        if self._use_cached(time_limit, memory_limit, wall_time_limit):
+            return
+        if self.run_slots is not None:
+            # Held only while the executable runs, so that checking does not
+            # hold up the next test case
+            self.run_slots.acquire()
+            self._run_slot = True
+        if self.admission is not None and not self.admission.acquire(self, memory_limit):
+            self._release_resources()
+            self._cancel()
+            return
+        with contextlib.ExitStack() as stack:
+            if not self._start(stack, time_limit, memory_limit):
+                self._cancel()
+                return
+            self.lpopen.lwait(tlimit=time_limit, mlimit=memory_limit, wlimit=wall_time_limit)
+            self._release_resources()
+            if self._aborted:
+                self._cancel()
+                return
+            self._check()
+
+    async def run_async(self, time_limit, memory_limit, wall_time_limit=None, executor=None,
+                        exited=None):
+        '''Like run(), but waits for the executable without blocking the event loop.  Output is
+        checked in `executor'.  `exited' is called once the executable is done, before its output
+        is checked.'''
+        loop = asyncio.get_event_loop()
+        if self.cache is not None and await loop.run_in_executor(
+                None, self._use_cached, time_limit, memory_limit, wall_time_limit):
+            return
+        if self.admission is not None:
+            # Waiting for memory blocks, so it happens in a thread
+            acquiring = loop.run_in_executor(None, self.admission.acquire, self, memory_limit)
+            try:
+                admitted = await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                self.abort()
+                if await acquiring:
+                    self.admission.release(self)
+                self._cancel()
+                raise
+            if not admitted:
+                self._cancel()
+                return
+        with contextlib.ExitStack() as stack:
+            if not self._start(stack, time_limit, memory_limit):
+                self._cancel()
+                return
+            if hasattr(self.lpopen, 'lwatch'):
+                waiting = loop.create_future()
+                def resolve(error):
+                    if not waiting.done():
+                        waiting.set_result(error)
+                self.lpopen.lwatch(time_limit, memory_limit, wall_time_limit,
+                                   lambda error: loop.call_soon_threadsafe(resolve, error))
+            else:
+                # Backends without a supervisor need a thread to wait in
+                waiting = loop.run_in_executor(executor, functools.partial(
+                    self.lpopen.lwait, tlimit=time_limit, mlimit=memory_limit,
+                    wlimit=wall_time_limit))
+            try:
+                # Shielded, so that cancelling does not lose track of the process
+                error = await asyncio.shield(waiting)
+            except asyncio.CancelledError:
+                self.abort()
+                # Keep the files around until the process is gone
+                await asyncio.wait([waiting])
+                self._cancel()
+                raise
+            if error is not None:
+                raise error
+            self._release_resources()
+            if exited is not None:
+                exited()
+            if self._aborted:
+                self._cancel()
+                return
+            checking = loop.run_in_executor(executor, self._check)
+            try:
+                await asyncio.shield(checking)
+            except asyncio.CancelledError:
+                # Too late to cancel, but the files are still needed
+                await asyncio.wait([checking])
+                raise
+
+    def _use_cached(self, time_limit, memory_limit, wall_time_limit):
+        '''Takes the verdict from the cache if the executable, test data, limits and checking
+        are all unchanged, returns whether it did.'''
+        if self.cache is None:
+            return False
+        try:
+            self._verdict_key = self.cache.verdict_key(
+                self.cache.file_hash(self.executable),
+                self.cache.file_hash(self.inpath),
+                self.cache.file_hash(self.refoutpath),
+                time_limit, memory_limit, wall_time_limit,
+                self.usaco_style_io, self.kernel_limits, self.cgroup, self.checker.cache_key())
+        except OSError:
+            # E.g. an executable found through PATH
+            return False
+        verdict = None if self.fresh else self.cache.get_verdict(self._verdict_key)
+        if verdict is None:
+            return False
+        self.result, self._cached_time, self._cached_memory = verdict
+        self.cached = True
+        self.status = Runner.DONE
+        return True
+
+    def _limit_keywords(self, time_limit, memory_limit):
+        # Extra lPopen arguments asking the kernel to enforce the limits too
+        if not self.kernel_limits:
+            return {}
+        return {'cpu_limit': time_limit, 'memory_limit': memory_limit}
 
     def abort(self):
         with self._abort_lock:
             self._aborted = True
             if self.lpopen:
                 self.lpopen.abort()
+            elif self.status == Runner.WAITING:
+                # May never get to run at all
+                self._cancel()
+
+    def _cancel(self):
+        self.result = Runner.Result.CANCELLED
+        self.status = Runner.DONE
 
-    def _run_with_normal_io(self, time_limit, memory_limit):
-        # Normally, I/O goes through standard streams.  Open the input file
-        # for stdin and a temporary file for stdout.
-        with open(self.inpath, 'rb') as infile:
-            with tempfile.NamedTemporaryFile() as outfile:
-                with self._abort_lock:
-                    if not self._aborted:
-                        self.lpopen = platform_dependent.lPopen(self.executable, stdin=infile, stdout=outfile, stderr=subprocess.DEVNULL)
-                self.status = Runner.RUNNING
-                self.lpopen.lwait(tlimit=time_limit, mlimit=memory_limit)
-                self.status = Runner.CHECKING
-                infile.seek(0)
-                outfile.seek(0)
-                infile.flush()
-                outfile.flush()
-                with open(self.refoutpath, 'rb') as refout:
-                    self.grade(infile, outfile, refout)
-                self.status = Runner.DONE
-
-    def _run_with_usaco_io(self, time_limit, memory_limit):
-        # In USACO-style tasks, the executable opens TASK.in and TASK.out
-        # itself.
-        with tempfile.TemporaryDirectory() as tmpdir:
+    def _start(self, stack, time_limit, memory_limit):
+        '''Sets up I/O and starts the executable, returns False if aborted.  Files are cleaned up
+        when `stack' is closed.'''
+        stack.callback(self._release_resources)
+        if not self.usaco_style_io:
+            # Normally, I/O goes through standard streams.  Open the input file
+            # for stdin and a temporary file for stdout.
+            self._infile = stack.enter_context(open(self.inpath, 'rb'))
+            self._outfile = stack.enter_context(tempfile.NamedTemporaryFile())
+            args = self.executable
+            keywords = {'stdin': self._infile, 'stdout': self._outfile}
+        else:
+            # In USACO-style tasks, the executable opens TASK.in and TASK.out
+            # itself.
+            tmpdir = stack.enter_context(tempfile.TemporaryDirectory())
             shutil.copy(self.inpath, os.path.join(tmpdir, self.task_name + '.in'))
-            outpath = os.path.join(tmpdir, self.task_name + '.out')
-            with self._abort_lock:
-                if not self._aborted:
-                    self.lpopen = platform_dependent.lPopen(os.path.realpath(self.executable), cwd=tmpdir, stderr=subprocess.DEVNULL)
-            self.status = Runner.RUNNING
-            self.lpopen.lwait(tlimit=time_limit, mlimit=memory_limit)
-            self.status = Runner.CHECKING
+            self._outpath = os.path.join(tmpdir, self.task_name + '.out')
+            args = os.path.realpath(self.executable)
+            keywords = {'cwd': tmpdir}
+        keywords.update(self._limit_keywords(time_limit, memory_limit))
+        if self.cgroup:
+            keywords['use_cgroup'] = True
+            keywords['cgroup_memory_limit'] = memory_limit
+        if self.cpu_slots is not None:
+            self._cpu = self.cpu_slots.acquire()
+            keywords['cpus'] = {self._cpu}
+        with self._abort_lock:
+            if self._aborted:
+                return False
+            self.lpopen = platform_dependent.lPopen(args, stderr=subprocess.DEVNULL, **keywords)
+        self.status = Runner.RUNNING
+        return True
+
+    def _release_resources(self):
+        # The core and memory are free for the next test case as soon as the
+        # executable is done
+        if self._cpu is not None:
+            self.cpu_slots.release(self._cpu)
+            self._cpu = None
+        if self.admission is not None:
+            self.admission.release(self)
+        if self._run_slot:
+            self._run_slot = False
+            self.run_slots.release()
+
+    def _check(self):
+        self.status = Runner.CHECKING
+        if not self.usaco_style_io:
+            self._infile.seek(0)
+            self._outfile.seek(0)
+            self._infile.flush()
+            self._outfile.flush()
+            with open(self.refoutpath, 'rb') as refout:
+                self.grade(self._infile, self._outfile, refout)
+        else:
+            # A solution that was stopped early may not have written any output
+            open(self._outpath, 'ab').close()
             with open(self.inpath, 'rb') as infile:
-                with open(outpath, 'rb') as outfile:
+                with open(self._outpath, 'rb') as outfile:
                     with open(self.refoutpath, 'rb') as refout:
                         self.grade(infile, outfile, refout)
-            self.status = Runner.DONE
+        # The idle limit depends on the load of the machine, not only on the
+        # executable, and a failing checker may work next time
+        if self._verdict_key is not None and self.result not in (Runner.Result.IDLE_LIMIT,
+                                                                 Runner.Result.CHECKER_ERROR):
+            self.cache.put_verdict(self._verdict_key, self.result, self.get_time(),
+                                   self.get_memory())
+        self.status = Runner.DONE
 
     def grade(self, infile, outfile, refout):
         if self.lpopen.timeout:
             self.result = Runner.Result.TIME_LIMIT
         elif self.lpopen.memout:
             self.result = Runner.Result.MEMORY_LIMIT
+        elif self.lpopen.idleout:
+            self.result = Runner.Result.IDLE_LIMIT
         elif self.lpopen.exitcode != 0:
             self.result = Runner.Result.RUNTIME_ERROR
         else:
             self.result = self.check_output(infile, outfile, refout)
 
     def check_output(self, infile, outfile, refout):
-        rv = self.checker.check(infile, outfile, refout)
-        if rv == checkers.CORRECT:
+        checked = self.checker.check(infile, outfile, refout)
+        self.message = checked.message
+        self.checker_time = checked.time
+        self.checker_memory = checked.memory
+        if checked.verdict == checkers.CORRECT:
             return Runner.Result.PASSED
-        elif rv == checkers.PRESENTATION_ERROR:
+        elif checked.verdict == checkers.PRESENTATION_ERROR:
             return Runner.Result.PRESENTATION_ERROR
+        elif checked.verdict == checkers.CHECKER_ERROR:
+            return Runner.Result.CHECKER_ERROR
         else:
             return Runner.Result.WRONG_ANSWER
 
     def get_time(self):
+        if self.cached:
+            return self._cached_time
         return self.lpopen.time if self.lpopen is not None else 0
 
+    def get_time_spread(self):
+        '''Returns how much the time varies between runs, None for a single run.'''
+        return None
+
     def get_memory(self):
+        if self.cached:
+            return self._cached_memory
         return self.lpopen.vmpeak if self.lpopen is not None else 0
@@ -0,0 +1,90 @@
+import os
+import threading
+
+from . import platform_dependent
+
+def _costs(runners, history):
+    # The cost of a test case is its CPU time from `history', or its input
+    # size otherwise.  Input sizes are converted to seconds at the rate
+    # observed on test cases with both.
+    sizes = []
+    times = []
+    for runner in runners:
+        try:
+            sizes.append(os.path.getsize(runner.inpath))
+        except OSError:
+            sizes.append(0)
+        times.append(history.get_time(runner.task_name, runner.inpath)
+                     if history is not None else None)
+
+    known = [(size, time) for size, time in zip(sizes, times) if time is not None]
+    known_size = sum(size for size, _ in known)
+    seconds_per_byte = sum(time for _, time in known) / known_size if known_size else 1
+
+    return [time if time is not None else size * seconds_per_byte
+            for size, time in zip(sizes, times)]
+
+def order_by_cost(runners, history):
+    '''Returns `runners' with the most expensive test cases first (longest processing time
+    first), so that heavy test cases do not start last and stretch the total wall time.
+
+    The cost of a test case is its CPU time from `history', or its input size otherwise.  Ties
+    keep their original order.'''
+    costs = _costs(runners, history)
+    order = sorted(range(len(runners)), key=lambda i: -costs[i])
+    return [runners[i] for i in order]
+
+def likely_failures_first(runners, history, examples):
+    '''Returns `runners' with those that failed in the previous run first, then those in
+    `examples', each cheapest first so that a failure shows up as soon as possible.  The others
+    keep their order.  Used to fail fast.'''
+    def priority(runner):
+        if history is not None and history.failed(runner.task_name, runner.inpath):
+            return 0
+        return 1 if runner in examples else 2
+    priorities = [priority(runner) for runner in runners]
+    costs = _costs(runners, history)
+    order = sorted(range(len(runners)),
+                   key=lambda i: (priorities[i], costs[i] if priorities[i] < 2 else 0))
+    return [runners[i] for i in order]
+
+
+class MemoryAdmission:
+    '''Admits test cases only while the memory reserved by running ones fits in `budget' bytes,
+    so that parallel test cases do not push the machine into swap.
+
+    A running test case reserves its whole memory limit until it exits: its usage early on says
+    nothing about its peak.  A test case is always admitted when nothing else is running, even if
+    its limit exceeds the budget.'''
+
+    # How often waiting test cases check whether they were aborted
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, budget):
+        self.budget = budget
+        self._running = {}
+        self._cv = threading.Condition()
+
+    @classmethod
+    def from_available_memory(cls, headroom):
+        '''Returns admission control for the currently available memory minus `headroom', or
+        None if available memory cannot be determined on this platform.'''
+        available = platform_dependent.available_memory()
+        if available is None:
+            return None
+        return cls(max(0, available - headroom))
+
+    def acquire(self, runner, memory_limit):
+        '''Blocks until `runner' fits, returns False if it was aborted while waiting.'''
+        with self._cv:
+            while self._running and sum(self._running.values()) + memory_limit > self.budget:
+                if runner.aborted:
+                    return False
+                self._cv.wait(self.POLL_INTERVAL)
+            self._running[runner] = memory_limit
+            return True
+
+    def release(self, runner):
+        with self._cv:
+            if self._running.pop(runner, None) is not None:
+                self._cv.notify_all()
@@ -1,39 +1,130 @@
 import signal
 import sys
+import threading
 import time
 
 from .clint.textui import colored
 from .runner import Runner
 
+RESULT_COLOR_TEXT = {
+    Runner.Result.PASSED:             (colored.green, 'Passed'),
+    Runner.Result.PRESENTATION_ERROR: (colored.yellow, 'Passed (PE)'),
+    Runner.Result.WRONG_ANSWER:       (colored.red, 'Wrong answer'),
+    Runner.Result.TIME_LIMIT:         (colored.cyan, 'Time limit'),
+    Runner.Result.MEMORY_LIMIT:       (colored.cyan, 'Memory limit'),
+    Runner.Result.IDLE_LIMIT:         (colored.cyan, 'Idle limit'),
+    Runner.Result.RUNTIME_ERROR:      (colored.magenta, 'Runtime error'),
+    Runner.Result.CANCELLED:          (None, 'Cancelled'),
+    Runner.Result.CHECKER_ERROR:      (colored.magenta, 'Checker error'),
+    }
+
 class Scoreboard:
     '''Monitors the results of individual test cases and display their status.'''
 
-    def __init__(self):
+    def __init__(self, fail_fast=False, baseline=None, rerun=None, reruns=0, time_limit=None,
+                 judge_time_limit=None):
+        '''With a `baseline', test cases that got slower or use more memory count as failures.
+        Those are first measured up to `reruns' more times with `rerun(runner)', which returns a
+        finished copy of the runner, and the best measurement counts.  With a
+        `judge_time_limit', the `time_limit' it was scaled to on this machine is shown first.'''
         self.monitors = []
         self.first_column_width = 0
         self.live_update = sys.stdout.isatty()
+        self.fail_fast = fail_fast
+        self.baseline = baseline
+        self.rerun = rerun
+        self.reruns = reruns
+        self.time_limit = time_limit
+        self.judge_time_limit = judge_time_limit
+        self._stopping = False
+        self._stopping_lock = threading.Lock()
 
     def add(self, infile, runner, future):
         self.monitors.append(SingleRunMonitor(infile, runner, future, self.write_row, self.live_update))
         self.first_column_width = max(self.first_column_width, len(infile))
+        if self.fail_fast:
+            future.add_done_callback(lambda future: self._on_done(runner))
+
+    def _on_done(self, runner):
+        # Called from worker threads as test cases finish, in any order
+        if runner.status != Runner.DONE or runner.result in (Runner.Result.PASSED,
+                                                              Runner.Result.CANCELLED):
+            return
+        with self._stopping_lock:
+            if self._stopping:
+                return
+            self._stopping = True
+        self.abort()
 
     def start(self):
         failures = 0
+        suspects = []
+        if self.judge_time_limit is not None:
+            print('Time limit %.2f s (%.2f s on the judge)' %
+                  (self.time_limit, self.judge_time_limit))
         try:
             while self.monitors:
                 current = self.monitors[0]
                 result = current.run() # synchronous
                 self.monitors.pop(0)
-                if result != Runner.Result.PASSED:
+                if result not in (Runner.Result.PASSED, Runner.Result.CANCELLED):
                     failures += 1
+                elif result == Runner.Result.PASSED and self._regressions(current.runner):
+                    suspects.append(current)
                 print()
+            # Measured again once everything else is done, on a quieter machine
+            for monitor in suspects:
+                failures += self.check_regression(monitor)
         except KeyboardInterrupt:
-            for monitor in self.monitors:
-                monitor.runner.abort()
+            self.abort()
             print()
             return 128 + signal.SIGINT
         return failures
 
+    def _regressions(self, *runners):
+        if self.baseline is None:
+            return []
+        return self.baseline.regressions(runners[0].task_name,
+                                         runners[0].inpath,
+                                         min(runner.get_time() for runner in runners),
+                                         min(runner.get_memory() for runner in runners))
+
+    def check_regression(self, monitor):
+        '''Re-measures a test case that regressed, prints the regressions that remain and returns
+        whether there were any.'''
+        runners = [monitor.runner]
+        regressions = self._regressions(*runners)
+        while regressions and len(runners) <= self.reruns and self.rerun is not None:
+            runner = self.rerun(monitor.runner)
+            if runner.status != Runner.DONE or runner.result != Runner.Result.PASSED:
+                break
+            runners.append(runner)
+            regressions = self._regressions(*runners)
+        for what, measured, base in regressions:
+            if what == 'time':
+                text, value, base_value = 'Slower', '%5.2f' % measured, '%.2f' % base
+            else:
+                text, value, base_value = ('More memory', '%4dM' % int(measured / 2**20),
+                                           '%dM' % int(base / 2**20))
+            print('%-*s | %s | %5s | baseline %s (%+.0f%%), best of %d' %
+                  (self.first_column_width,
+                   monitor.infile,
+                   colored.red('%-13s' % text),
+                   value,
+                   base_value,
+                   100 * (measured - base) / base if base else float('inf'),
+                   len(runners)))
+        return bool(regressions)
+
+    def abort(self):
+        '''Cancels test cases that have not started yet and stops the running ones.'''
+        monitors = list(self.monitors)
+        # Runners first, so that a cancelled future always has a verdict
+        for monitor in monitors:
+            monitor.runner.abort()
+        for monitor in monitors:
+            monitor.future.cancel()
+
     def write_row(self, infile, runner):
         time = runner.get_time()
         memory = int(runner.get_memory() / 1048576)
@@ -42,13 +133,26 @@ class Scoreboard:
         if memory:
             memstr = '%4dM' % memory
 
-        print('%s%-*s | %s | %5.2f | %5s' %
+        spread = runner.get_time_spread()
+        timestr = '%5.2f' % time
+        if spread is not None:
+            timestr += ' ±%4.2f' % spread
+
+        checkerstr = ''
+        if runner.status == Runner.DONE and runner.checker_time is not None:
+            checkerstr = ' (checker %.2f s, %dM)' % (runner.checker_time,
+                                                     runner.checker_memory / 1048576)
+
+        print('%s%-*s | %s | %s | %5s%s%s%s' %
               ('\r' if self.live_update else '',
                self.first_column_width,
                infile,
                self.get_text_status(13, runner),
-               time,
-               memstr),
+               timestr,
+               memstr,
+               ' (cached)' if runner.cached else '',
+               checkerstr,
+               ' ' + runner.message if runner.status == Runner.DONE and runner.message else ''),
               end='')
 
     def get_text_status(self, width, runner):
@@ -66,15 +170,7 @@ class Scoreboard:
             return status_to_color_text[runner.status]
         assert runner.status == Runner.DONE
 
-        result_to_color_text = {
-            Runner.Result.PASSED:             (colored.green, 'Passed'),
-            Runner.Result.PRESENTATION_ERROR: (colored.yellow, 'Passed (PE)'),
-            Runner.Result.WRONG_ANSWER:       (colored.red, 'Wrong answer'),
-            Runner.Result.TIME_LIMIT:         (colored.cyan, 'Time limit'),
-            Runner.Result.MEMORY_LIMIT:       (colored.cyan, 'Memory limit'),
-            Runner.Result.RUNTIME_ERROR:      (colored.magenta, 'Runtime error'),
-            }
-        return result_to_color_text[runner.result]
+        return RESULT_COLOR_TEXT[runner.result]
 
 
 class SingleRunMonitor:
@@ -89,11 +185,13 @@ class SingleRunMonitor:
         self.write_row_callback(self.infile, self.runner)
 
     def run(self):
-        while not self.future.done():
+        # A cancelled future may be done before its runner has stopped
+        while not self.future.done() or (self.future.cancelled() and
+                                         self.runner.status != Runner.DONE):
             if self.live_update:
                 self.update()
             time.sleep(0.1)
         self.update()
-        if self.future.exception() is not None:
+        if not self.future.cancelled() and self.future.exception() is not None:
             raise self.future.exception()
         return self.runner.result
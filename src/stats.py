@@ -0,0 +1,30 @@
+'''Small statistics helpers for timing measurements.'''
+
+import math
+import statistics
+
+# Two-sided 95% critical values of Student's t distribution, by degrees of
+# freedom
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+def t_critical(df):
+    '''Returns the two-sided 95% critical value of Student's t distribution.'''
+    if df <= len(T_95):
+        return T_95[df - 1]
+    return 1.96
+
+def geometric_mean_interval(ratios):
+    '''Returns (geometric mean, low, high) of positive `ratios', with a 95% confidence interval
+    computed on their logarithms.  The interval is None for fewer than two ratios.'''
+    logs = [math.log(ratio) for ratio in ratios]
+    mean = statistics.mean(logs)
+    if len(logs) < 2:
+        return math.exp(mean), None, None
+    margin = t_critical(len(logs) - 1) * statistics.stdev(logs) / math.sqrt(len(logs))
+    return math.exp(mean), math.exp(mean - margin), math.exp(mean + margin)
+
+def spread(samples):
+    '''Returns the sample standard deviation, or 0 for fewer than two samples.'''
+    return statistics.stdev(samples) if len(samples) > 1 else 0
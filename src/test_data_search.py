@@ -40,17 +40,22 @@ FULL_PATTERNS = [
 ]
 
 
-TestCase = collections.namedtuple('TestCase', ['task', 'dirpath', 'infile', 'outfile'])
+TestCase = collections.namedtuple('TestCase', ['task', 'dirpath', 'infile', 'outfile', 'example'],
+                                  defaults=[False])
+
+
+def natural_key(filename):
+    """ Sort key that orders the numbers in file names numerically.
+    """
+    convert = lambda text: int(text) if text.isdigit() else text
+    return [ convert(c) for c in re.split('([0-9]+)', filename) ]
 
 
 def sort_filenames(l):
     """ Sort the given list in the way that humans expect.
         http://www.codinghorror.com/blog/2007/12/sorting-for-humans-natural-sort-order.html
     """
-    import re
-    convert = lambda text: int(text) if text.isdigit() else text
-    alphanum_key = lambda test_case: [ convert(c) for c in re.split('([0-9]+)', test_case.infile) ]
-    l.sort(key=alphanum_key)
+    l.sort(key=lambda test_case: natural_key(test_case.infile))
 
 
 class TestDataSearch:
@@ -84,14 +89,17 @@ class TestDataSearch:
         for dirpath, _, filenames in os.walk(self.search_dir):
             for task in tasks_to_try:
                 for pattern in patterns:
-                    rv = self.search_one_pattern(dirpath, filenames, task, pattern)
+                    example = pattern in EXAMPLE_PATTERNS
+                    rv = self.search_one_pattern(dirpath, filenames, task, pattern, example)
                     logging.debug('pattern {}: {}'.format(pattern[0], rv))
                     # Some patterns do not depend on the task name so we might
                     # go through them more than once if we are trying different
                     # task names.  To deal with this, `tests' is a dict keyed
                     # by the input file, which will dedup.
                     for tc in rv:
-                        tests[(tc.dirpath, tc.infile)] = tc
+                        key = (tc.dirpath, tc.infile)
+                        if key not in tests or not tests[key].example:
+                            tests[key] = tc
         tests = list(tests.values())
         if not tests:
             logging.error('No test data found!')
@@ -100,7 +108,7 @@ class TestDataSearch:
         sort_filenames(tests)
         return tests
 
-    def search_one_pattern(self, dirpath, filenames, task, pattern):
+    def search_one_pattern(self, dirpath, filenames, task, pattern, example=False):
         tests = []
         re_in = re.compile(pattern[0].replace('TASK', task) + '$', re.IGNORECASE)
         re_out = re.compile(pattern[1].replace('TASK', task) + '$', re.IGNORECASE)
@@ -117,5 +125,6 @@ class TestDataSearch:
                 tests.append(TestCase(task=task,
                                       dirpath=dirpath,
                                       infile=infile,
-                                      outfile=outputs[seq]))
+                                      outfile=outputs[seq],
+                                      example=example))
         return tests
@@ -0,0 +1,46 @@
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src import checkers
+
+
+class FloatCheckerInfinityTest(unittest.TestCase):
+    '''Infinities are only close to themselves, with and without numpy.'''
+
+    CASES = [
+        (b'1', b'inf', checkers.WRONG_ANSWER),
+        (b'-5', b'-inf', checkers.WRONG_ANSWER),
+        (b'inf', b'-inf', checkers.WRONG_ANSWER),
+        (b'inf', b'1', checkers.WRONG_ANSWER),
+        (b'inf', b'Infinity', checkers.CORRECT),
+        (b'-inf', b'-Infinity', checkers.CORRECT),
+        # Non-numeric tokens send the block through the per-token path
+        (b'YES 1', b'NO inf', checkers.WRONG_ANSWER),
+        (b'YES 1', b'YES inf', checkers.WRONG_ANSWER),
+        (b'YES inf', b'YES Infinity', checkers.CORRECT),
+        ]
+
+    def check(self, out, ref):
+        with tempfile.TemporaryFile() as outfile, tempfile.TemporaryFile() as refout:
+            outfile.write(out)
+            refout.write(ref)
+            return checkers.FloatChecker(1e-6, 1e-6).check(None, outfile, refout).verdict
+
+    def test_without_numpy(self):
+        with mock.patch.object(checkers, 'numpy', None):
+            for out, ref, verdict in self.CASES:
+                self.assertEqual(self.check(out, ref), verdict, (out, ref))
+
+    @unittest.skipIf(checkers.numpy is None, 'numpy not installed')
+    def test_with_numpy(self):
+        for out, ref, verdict in self.CASES:
+            self.assertEqual(self.check(out, ref), verdict, (out, ref))
+
+
+if __name__ == '__main__':
+    unittest.main()